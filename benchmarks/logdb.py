@@ -0,0 +1,104 @@
+'''Synthetic "log.db" for benchmarks
+
+Targets are "project@tag" and "@tag" with Zipf-like popularity, an activity
+is kept for a few rows before switching. Work and break rows are mixed
+(about 70% are work) and spread evenly over `years` till `end`, so the
+size of rows depends on their count. The same arguments give the same
+database.
+'''
+import argparse
+import os
+import random
+import sqlite3
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import tider  # noqa
+
+
+def get_targets(rnd, count=300):
+    word = lambda: ''.join(
+        rnd.choice(string.ascii_lowercase) for i in range(rnd.randint(3, 8))
+    )
+    tags = [word() for i in range(30)]
+    targets = set()
+    while len(targets) < count:
+        project = word() if rnd.random() < 0.8 else ''
+        targets.add('%s@%s' % (project, rnd.choice(tags)))
+    return sorted(targets)
+
+
+def get_rows(count, years=3, end=None, seed=0):
+    rnd = random.Random(seed)
+    targets = get_targets(rnd)
+    weights = [1 / (i + 1) for i in range(len(targets))]
+    rnd.shuffle(targets)
+
+    end = int(end or time.time())
+    step = years * 365 * 24 * 3600 / count
+    start = end - years * 365 * 24 * 3600
+    target = targets[0]
+    for i in range(count):
+        if rnd.random() < 0.4:
+            target = rnd.choices(targets, weights)[0]
+        active = rnd.random() < 0.7
+        duration = rnd.uniform(0.5, 1.5) * step * (1.3 if active else 0.3)
+        duration = max(1, int(duration))
+        yield (
+            target, start, start + duration,
+            duration if active else 0,
+            0 if active else duration,
+        )
+        start += duration
+
+
+def create(path, count, years=3, end=None, seed=0):
+    '''Create database at `path`, it is returned as is if exists'''
+    if os.path.exists(path):
+        return path
+
+    tmp = path + '.tmp'
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    db = sqlite3.connect(tmp)
+    db.execute('PRAGMA journal_mode = OFF')
+    db.execute('PRAGMA synchronous = OFF')
+    # Only "log" table, totals are filled by later migrations at once
+    db.executescript(tider.MIGRATIONS[0] + '; PRAGMA user_version = 1;')
+    rows = get_rows(count, years, end, seed)
+    with db:
+        while True:
+            batch = [r for i, r in zip(range(10000), rows)]
+            if not batch:
+                break
+            db.executemany(
+                'INSERT INTO log (target, start, end, work, break)'
+                '   VALUES (?, ?, ?, ?, ?)',
+                batch
+            )
+    tider.init_db(db)
+    db.execute('ANALYZE')
+    db.close()
+    os.rename(tmp, path)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path')
+    parser.add_argument('-r', '--rows', type=int, default=10000)
+    parser.add_argument('-y', '--years', type=int, default=3)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-e', '--end', type=int, help='timestamp of the end')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    create(args.path, args.rows, args.years, args.end, args.seed)
+    print('%s: %.1fs' % (args.path, time.perf_counter() - start))
+
+
+if __name__ == '__main__':
+    main()
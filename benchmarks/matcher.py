@@ -0,0 +1,59 @@
+'''Benchmark of target completion matcher on a synthetic corpus
+
+Names look like "project@tag" and "@tag", prints microseconds per query
+for prefix, part prefix and fuzzy queries as JSON.
+'''
+import argparse
+import json
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import tider  # noqa
+
+
+def get_names(count, seed=0):
+    rnd = random.Random(seed)
+    word = lambda: ''.join(
+        rnd.choice(string.ascii_lowercase) for i in range(rnd.randint(3, 8))
+    )
+    tags = [word() for i in range(200)]
+    names = set()
+    while len(names) < count:
+        project = word() if rnd.random() < 0.9 else ''
+        names.add('%s@%s' % (project, rnd.choice(tags)))
+    return list(names)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--names', type=int, default=50000)
+    parser.add_argument('--number', type=int, default=200)
+    args = parser.parse_args()
+
+    names = get_names(args.names)
+    build = timeit.timeit(lambda: tider.Matcher(names), number=1)
+    matcher = tider.Matcher(names)
+
+    queries = {
+        'empty': '',
+        'letter': 'p',
+        'prefix': names[0][:3],
+        'part_prefix': '@' + names[0].split('@')[1][:2],
+        'fuzzy': 'qzx',
+        'fuzzy_rare': 'zqjx',
+    }
+    result = {'names': len(names), 'build_ms': round(build * 1000, 1)}
+    for name, query in queries.items():
+        match = lambda: matcher.match(query)
+        seconds = timeit.timeit(match, number=args.number)
+        result[name + '_us'] = round(seconds / args.number * 1e6, 1)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
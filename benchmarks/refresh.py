@@ -0,0 +1,47 @@
+'''Micro-benchmark of one `State.refresh()` cycle
+
+Uses a temporary config directory with an empty database, so it measures
+the in-memory path: statistics, `text_hook` and tick scheduling.
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import timeit
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import tider  # noqa
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--number', type=int, default=10000)
+    args = parser.parse_args()
+
+    conf = tider.get_config(tempfile.mkdtemp())
+    state = tider.State(conf, tider.Notifier(lambda *a: None))
+    state.set_activity(True, 'pusto@dev')
+
+    def per_call(stmt):
+        seconds = timeit.timeit(stmt, number=args.number)
+        return round(seconds / args.number * 1e6, 3)
+
+    fields = tider.Ctx.__slots__
+    print(json.dumps({
+        'number': args.number,
+        'refresh_us': per_call(state.refresh),
+        'refresh_and_timeout_us': per_call(
+            lambda: (state.refresh(), state.get_timeout())
+        ),
+        'ctx_instance_us': per_call(lambda: tider.Ctx(target='x')),
+        'ctx_class_us': per_call(lambda: namedtuple('Ctx', fields)),
+        'split_seconds_us': per_call(lambda: tider.split_seconds(3671)),
+    }, indent=2))
+    conf.db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+'''Load test of the control socket
+
+Fires many concurrent `ping` calls and prints latency percentiles as JSON.
+By default an in-process server with a no-op handler is started, use
+`--socket` to test a running tider instance.
+'''
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import tider  # noqa
+
+
+class Handler:
+    def pub_ping(self):
+        pass
+
+
+async def dispatch(action, *args):
+    return action(*args)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', '--calls', type=int, default=5000)
+    parser.add_argument('-c', '--clients', type=int, default=32)
+    parser.add_argument('--socket', help='address of running instance')
+    args = parser.parse_args()
+
+    address = args.socket
+    if not address:
+        address = os.path.join(tempfile.mkdtemp(), 'socket')
+        server = tider.Server(address, Handler(), dispatch)
+        Thread(target=server.run, daemon=True).start()
+        while not os.path.exists(address):
+            time.sleep(0.01)
+
+    def call(i):
+        start = time.perf_counter()
+        reply = tider.send_action(address, 'ping')
+        return time.perf_counter() - start, reply == tider.OK
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(args.clients) as pool:
+        results = list(pool.map(call, range(args.calls)))
+    total = time.perf_counter() - start
+
+    latency = [r[0] * 1000 for r in results]
+    print(json.dumps({
+        'calls': args.calls,
+        'clients': args.clients,
+        'errors': sum(1 for r in results if not r[1]),
+        'calls_per_sec': round(args.calls / total),
+        'p50_ms': round(percentile(latency, 50), 3),
+        'p99_ms': round(percentile(latency, 99), 3),
+        'max_ms': round(max(latency), 3),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
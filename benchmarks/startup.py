@@ -0,0 +1,60 @@
+'''Startup time of CLI commands
+
+Runs every command several times and prints median wall-clock time and
+`python -X importtime` total for `import tider` as JSON. Without running
+instance `tider call ping` fails fast, that is fine for this measure.
+'''
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess as sp
+import sys
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+COMMANDS = {
+    'module': [sys.executable, '-m', 'tider'],
+    'script': [sys.executable, os.path.join(ROOT, 'tider')],
+}
+
+
+def measure(cmd, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        sp.call(cmd, cwd=ROOT, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 2)
+
+
+def import_time():
+    cmd = [sys.executable, '-X', 'importtime', '-c', 'import tider']
+    out = sp.run(cmd, cwd=ROOT, stderr=sp.PIPE, universal_newlines=True)
+    modules = {}
+    for line in out.stderr.splitlines():
+        match = re.match(r'import time:\s+\d+ \|\s+(\d+) \| (\s*)(\S+)', line)
+        if match and not match.group(2):
+            modules[match.group(3)] = int(match.group(1)) / 1000
+    return {
+        'tider_ms': modules.get('tider'),
+        'gtk_loaded': any(m.startswith('gi') for m in modules),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--repeat', type=int, default=20)
+    parser.add_argument('args', nargs='*', default=['call', 'ping'])
+    args = parser.parse_args()
+
+    result = {'args': args.args, 'import': import_time()}
+    for name, cmd in COMMANDS.items():
+        result[name + '_ms'] = measure(cmd + args.args, args.repeat)
+    result['python_ms'] = measure([sys.executable, '-c', 'pass'], args.repeat)
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+'''Timings of reports and state on synthetic databases
+
+Databases are generated by `logdb.py` into `--data` directory and reused,
+they end today at midnight, so a new day gives new ones (10M rows take a
+few minutes). Everything runs without display: reports, `State` and
+`Matcher` are called directly. Prints median milliseconds as JSON.
+'''
+import argparse
+import datetime as dt
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess as sp
+import sys
+import tempfile
+import time
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+
+import logdb  # noqa
+import tider  # noqa
+
+
+def measure(func, repeat):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(times), 3)
+
+
+def get_conf(data, rows, seed):
+    today = dt.date.today()
+    conf_dir = os.path.join(data, '%s-%s-%s' % (
+        rows, seed, today.strftime('%Y%m%d')
+    ))
+    os.makedirs(conf_dir, exist_ok=True)
+    end = time.mktime(today.timetuple())
+    logdb.create(os.path.join(conf_dir, 'log.db'), rows, end=end, seed=seed)
+
+    last = os.path.join(conf_dir, 'last.txt')
+    if os.path.exists(last):
+        os.remove(last)
+    return tider.get_config(conf_dir)
+
+
+def bench(conf, repeat):
+    yesterday = dt.date.today() - dt.timedelta(days=1)
+    interval = lambda days: [
+        (yesterday - dt.timedelta(days=days - 1)).strftime(tider.SQL_DATE),
+        yesterday.strftime(tider.SQL_DATE)
+    ]
+    results = {}
+
+    def run(name, func):
+        results[name] = measure(func, repeat)
+
+    for name, days in [('day', 1), ('week', 7), ('year', 365)]:
+        run('report_' + name, lambda: tider.render_text([
+            tider.get_report(conf, interval(days))
+        ]))
+    run('report_tree_year', lambda: tider.render_text([
+        tider.get_report(conf, interval(365), tree='@')
+    ]))
+    for granularity, days in [('daily', 31), ('weekly', 91), ('monthly', 365)]:
+        run('reports_' + granularity, lambda: tider.render_text(
+            tider.get_reports(conf, interval(days), granularity)
+        ))
+
+    notifier = tider.Notifier(lambda *a: None)
+    state = tider.State(conf, notifier)
+    names = state.get_targets()
+    now = time.time()
+    state.update(target=names[0], active=True, start=now - 600, last=now)
+    run('state_cold', lambda: tider.State(conf, notifier).refresh())
+    run('refresh', state.refresh)
+    run('get_last_working', state.get_last_working)
+
+    def targets():
+        state._targets = None
+        state.get_targets()
+    run('targets', targets)
+
+    run('matcher_build', lambda: tider.Matcher(names))
+    matcher = tider.Matcher(names)
+    queries = [
+        ('prefix', names[0][:2]),
+        ('part_prefix', '@' + names[0].split('@')[1][:2]),
+        ('fuzzy', names[-1][::2]),
+    ]
+    for name, query in queries:
+        run('match_' + name, lambda: matcher.match(query))
+    return results
+
+
+def get_version():
+    try:
+        cmd = ['git', 'describe', '--always', '--dirty']
+        return sp.check_output(cmd, cwd=ROOT, stderr=sp.DEVNULL).decode()\
+            .strip()
+    except (OSError, sp.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-r', '--rows', type=int, nargs='+',
+        default=[10000, 1000000, 10000000]
+    )
+    parser.add_argument('-n', '--repeat', type=int, default=20)
+    parser.add_argument('-s', '--seed', type=int, default=0)
+    parser.add_argument('-d', '--data', default=os.path.join(
+        tempfile.gettempdir(), 'tider-bench'
+    ))
+    args = parser.parse_args()
+
+    results = {}
+    for rows in args.rows:
+        conf = get_conf(args.data, rows, args.seed)
+        results[rows] = bench(conf, args.repeat)
+        conf.db.close()
+
+    print(json.dumps({
+        'version': get_version(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'repeat': args.repeat,
+        'results': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -2,8 +2,8 @@ import sys
 from distutils.core import setup
 from distutils.command.build_py import build_py
 
-if sys.version_info <= (3, 2):
-    sys.stderr.write("Tider requires Python 3.2+\n")
+if sys.version_info < (3, 7):
+    sys.stderr.write("Tider requires Python 3.7+\n")
     sys.exit(1)
 
 setup(
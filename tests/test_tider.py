@@ -0,0 +1,982 @@
+import asyncio
+import datetime as dt
+import json
+import os
+import sqlite3
+import struct
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import tider  # noqa
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def tick(self, seconds):
+        self.now += seconds
+
+
+class Notifier:
+    def __init__(self):
+        self.sent = []
+
+    def notify(self, summary, body='', timeout=None, urgent=False):
+        self.sent.append(summary)
+
+
+def get_conf(conf_dir, **settings):
+    conf_dir = str(conf_dir)
+    os.makedirs(conf_dir, exist_ok=True)
+    with open(os.path.join(conf_dir, 'config.py'), 'w') as f:
+        f.write(''.join('%s = %r\n' % i for i in settings.items()))
+    return tider.get_config(conf_dir)
+
+
+def get_rows(conf):
+    db, cursor = conf.db()
+    cursor.execute(
+        'SELECT %s FROM log ORDER BY start, target'
+        % ', '.join(tider.LOG_FIELDS)
+    )
+    return cursor.fetchall()
+
+
+def insert_rows(conf, rows):
+    db, cursor = conf.db()
+    with db:
+        cursor.executemany(
+            'INSERT INTO log (%s) VALUES (?, ?, ?, ?, ?)'
+            % ', '.join(tider.LOG_FIELDS), rows
+        )
+
+
+def check_totals(conf):
+    db, cursor = conf.db()
+    cursor.execute(
+        'SELECT day, target, work, break, entries FROM daily_totals '
+        'ORDER BY day, target'
+    )
+    totals = cursor.fetchall()
+    cursor.execute(
+        "SELECT date(start, 'unixepoch', 'localtime'), target, "
+        '   SUM(IFNULL(work, 0)), SUM(IFNULL(break, 0)), COUNT(*) '
+        'FROM log GROUP BY 1, 2 ORDER BY 1, 2'
+    )
+    assert totals == cursor.fetchall()
+
+    cursor.execute(
+        'SELECT name, last_used, use_count, total_work FROM targets '
+        'ORDER BY name'
+    )
+    targets = cursor.fetchall()
+    cursor.execute(
+        'SELECT target, MAX(start), COUNT(*), SUM(IFNULL(work, 0)) '
+        'FROM log GROUP BY 1 ORDER BY 1'
+    )
+    assert targets == cursor.fetchall()
+
+
+@pytest.fixture
+def conf(tmp_path):
+    conf = get_conf(tmp_path / 'conf')
+    yield conf
+    conf.db.close()
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # The morning of today, so rows are in today's statistics
+    today = dt.datetime.combine(dt.date.today(), dt.time(8))
+    clock = Clock(time.mktime(today.timetuple()))
+    monkeypatch.setattr(tider.time, 'time', clock)
+    return clock
+
+
+def test_state_save_log(conf, clock):
+    notifier = Notifier()
+    state = tider.State(conf, notifier)
+    state.set_activity(True, 'pusto@dev')
+    start = clock.now
+    for i in range(10):
+        clock.tick(100)
+        state.refresh()
+    assert state.duration == (0, 16, 40)
+    assert '0:16 pusto@dev' in state.text
+    assert get_rows(conf) == []
+
+    state.set_activity(False)
+    assert get_rows(conf) == [('pusto@dev', start, start + 1000, 1000, 0)]
+    assert notifier.sent == []
+
+    # The state is restored by the next instance
+    state = tider.State(conf, notifier)
+    assert (state.target, state.active) == ('pusto@dev', False)
+
+    # Too short activities are not saved
+    state.set_activity(True)
+    clock.tick(30)
+    state.set_activity(True, 'lal@mix')
+    assert len(get_rows(conf)) == 1
+
+
+def test_state_write_behind(conf, clock):
+    state = tider.State(conf, Notifier())
+    state.set_activity(True, 'pusto@dev')
+    path = os.path.join(conf.conf_dir, 'last.txt')
+    stamp = tider.get_stamp(path)
+
+    # Only `last` is changed by ticks, it is checkpointed
+    clock.tick(conf.checkpoint_period / 2)
+    state.refresh()
+    assert tider.get_stamp(path) == stamp
+    clock.tick(conf.checkpoint_period)
+    state.refresh()
+    assert tider.get_stamp(path) != stamp
+    assert tider.State(conf, Notifier()).last == clock.now
+
+
+def test_state_stats(conf, clock):
+    state = tider.State(conf, Notifier())
+    state.set_activity(True, 'pusto@dev')
+    cache = state.get_cache()
+    clock.tick(300)
+    state.set_activity(True, 'lal@mix')
+    clock.tick(120)
+    state.set_activity(False)
+
+    # Saved rows are added to the cache, it isn't loaded again
+    assert state.get_cache() is cache
+    assert cache['report'] == {'pusto@dev': 300, 'lal@mix': 120}
+    assert 'Last working period</b>\n  <b>7m 0s</b>' in state.stats
+    assert '|pusto@dev|      5m 0s|' in state.stats
+    assert '|total    |      7m 0s|' in state.stats
+
+
+def test_state_external_changes(conf, clock):
+    state = tider.State(conf, Notifier())
+    state.set_activity(True, 'pusto@dev')
+    clock.tick(300)
+    state.refresh()
+    cache = state.get_cache()
+    assert state.get_targets() == []
+
+    # Own commits don't drop the cache
+    state.set_activity(True, 'lal@mix')
+    state.refresh()
+    assert state.get_cache() is cache
+    assert state.get_targets() == ['pusto@dev']
+
+    # Commits of other connections do, so imported rows are counted
+    db = sqlite3.connect(conf.db_path)
+    with db:
+        db.execute(
+            'INSERT INTO log (target, start, end, work, break) '
+            '   VALUES (?, ?, ?, ?, ?)',
+            ['tider@dev', clock.now - 1000, clock.now - 400, 600, 0]
+        )
+    db.close()
+    state.refresh()
+    assert state.get_cache() is not cache
+    assert state.get_cache()['report'] == {'pusto@dev': 300, 'tider@dev': 600}
+    assert state.get_targets() == ['tider@dev', 'pusto@dev']
+    assert '|total    |     15m 0s|' in state.stats
+
+
+def create_first_db(path, rows):
+    # The first schema has no "user_version"
+    db = sqlite3.connect(str(path))
+    db.executescript(tider.MIGRATIONS[0])
+    db.executemany(
+        'INSERT INTO log (%s) VALUES (?, ?, ?, ?, ?)'
+        % ', '.join(tider.LOG_FIELDS), rows
+    )
+    db.commit()
+    db.close()
+
+
+def test_upgrade_first_db(tmp_path):
+    conf_dir = tmp_path / 'conf'
+    os.makedirs(str(conf_dir))
+    create_first_db(conf_dir / 'log.db', [
+        ('pusto@dev', 1500000000, 1500001000, 1000, 0),
+        ('pusto@dev', 1500002000, 1500002500, 0, 500),
+        ('lal@mix', 1500100000, 1500100100, 100, None),
+    ])
+
+    conf = get_conf(conf_dir)
+    db, cursor = conf.db()
+    cursor.execute('PRAGMA user_version')
+    assert cursor.fetchone()[0] == len(tider.MIGRATIONS)
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index'")
+    assert 'log_start' in {r[0] for r in cursor}
+    assert len(get_rows(conf)) == 3
+    check_totals(conf)
+    conf.db.close()
+
+
+def test_upgrade_concurrently(tmp_path):
+    path = str(tmp_path / 'log.db')
+    create_first_db(path, [('pusto@dev', 1500000000, 1500001000, 1000, 0)])
+
+    errors = []
+
+    def upgrade():
+        db = sqlite3.connect(path, timeout=10)
+        try:
+            tider.init_db(db)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=upgrade) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+    db = sqlite3.connect(path)
+    assert db.execute('PRAGMA user_version').fetchone()[0] == (
+        len(tider.MIGRATIONS)
+    )
+    db.close()
+
+
+def test_failed_migration(tmp_path, monkeypatch):
+    path = str(tmp_path / 'log.db')
+    db = sqlite3.connect(path)
+    tider.init_db(db)
+    monkeypatch.setattr(tider, 'MIGRATIONS', tider.MIGRATIONS + [
+        'CREATE TABLE `new`(`id` INTEGER);\nCREATE TABLE `log`(`id` INTEGER);'
+    ])
+    with pytest.raises(sqlite3.OperationalError):
+        tider.init_db(db)
+
+    # The whole migration is rolled back
+    assert db.execute('PRAGMA user_version').fetchone()[0] == (
+        len(tider.MIGRATIONS) - 1
+    )
+    cursor = db.execute("SELECT name FROM sqlite_master WHERE name = 'new'")
+    assert cursor.fetchall() == []
+    db.close()
+
+
+def test_totals_triggers(conf):
+    day = 24 * 60 * 60
+    insert_rows(conf, [
+        ('pusto@dev', 1500000000, 1500001000, 1000, 0),
+        ('pusto@dev', 1500002000, 1500002500, 0, 500),
+        ('lal@mix', 1500003000, 1500003100, 100, None),
+        ('lal@mix', 1500000000 + day, 1500000000 + day + 60, 60, 0),
+    ])
+    check_totals(conf)
+
+    db, cursor = conf.db()
+    with db:
+        cursor.execute('UPDATE log SET work = 900 WHERE work = 1000')
+    check_totals(conf)
+    with db:
+        cursor.execute(
+            "UPDATE log SET target = 'arch@tune' WHERE target = 'lal@mix'"
+        )
+    check_totals(conf)
+    with db:
+        cursor.execute('UPDATE log SET start = start + ? WHERE work = 900', [
+            2 * day
+        ])
+    check_totals(conf)
+    with db:
+        cursor.execute("DELETE FROM log WHERE target = 'pusto@dev'")
+    check_totals(conf)
+    with db:
+        cursor.execute('DELETE FROM log')
+    check_totals(conf)
+    cursor.execute('SELECT COUNT(*) FROM daily_totals')
+    assert cursor.fetchone()[0] == 0
+
+
+def at_noon(day):
+    day = dt.datetime.strptime(day, tider.SQL_DATE).replace(hour=12)
+    return int(time.mktime(day.timetuple()))
+
+
+def test_report_buckets(conf):
+    insert_rows(conf, [
+        (target, at_noon(day), at_noon(day) + work, work, 0)
+        for target, day, work in [
+            ('pusto@dev', '2015-03-04', 10),
+            ('pusto@dev', '2015-03-08', 100),
+            ('pusto@dev', '2015-03-09', 200),
+            ('lal@mix', '2015-03-31', 50),
+            ('lal@mix', '2015-04-01', 70),
+            ('lal@mix', '2015-04-03', 10),
+        ]
+    ])
+    interval = ['2015-03-05', '2015-04-02']
+
+    # Weeks start on Monday, the first and the last are cut by interval
+    weekly = tider.get_report_buckets(conf, interval, 'weekly')
+    assert weekly == [
+        (['2015-03-05', '2015-03-08'], [('pusto@dev', 100)]),
+        (['2015-03-09', '2015-03-15'], [('pusto@dev', 200)]),
+        (['2015-03-16', '2015-03-22'], []),
+        (['2015-03-23', '2015-03-29'], []),
+        (['2015-03-30', '2015-04-02'], [('lal@mix', 120)]),
+    ]
+    monthly = tider.get_report_buckets(conf, interval, 'monthly')
+    assert monthly == [
+        (['2015-03-05', '2015-03-31'], [('pusto@dev', 300), ('lal@mix', 50)]),
+        (['2015-04-01', '2015-04-02'], [('lal@mix', 70)]),
+    ]
+    daily = tider.get_report_buckets(conf, interval, 'daily', 'lal%')
+    assert len(daily) == 29
+    assert [b for b in daily if b[1]] == [
+        (['2015-03-31', '2015-03-31'], [('lal@mix', 50)]),
+        (['2015-04-01', '2015-04-01'], [('lal@mix', 70)]),
+    ]
+
+    reports = tider.get_reports(conf, interval, 'monthly')
+    assert [r.rows for r in reports[-1:]] == [
+        [('pusto@dev', 300, 0), ('lal@mix', 120, 0)]
+    ]
+    text = tider.render_text(reports)
+    assert [i for i in text.splitlines() if i.startswith('Statistics')] == [
+        'Statistics from 2015-03-05 to 2015-03-31',
+        'Statistics from 2015-04-01 to 2015-04-02',
+        'Statistics from 2015-03-05 to 2015-04-02',
+    ]
+
+
+def test_notifier():
+    sent, times = [], []
+    started, release = threading.Event(), threading.Event()
+
+    def send(summary, body, timeout=None, urgent=False):
+        # The first notification is slow, so the next ones are pending
+        started.set()
+        release.wait(1)
+        sent.append((summary, body))
+        times.append(time.perf_counter())
+
+    notifier = tider.Notifier(send, min_interval=0.05)
+    notifier.notify('Take a break!', '1')
+    started.wait(1)
+    notifier.notify('Overwork', '1')
+    notifier.notify('Overwork', '2')
+    notifier.notify('Take a break!', '2')
+    release.set()
+
+    deadline = time.time() + 2
+    while notifier.sent < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    assert sent == [
+        ('Take a break!', '1'), ('Overwork', '2'), ('Take a break!', '2')
+    ]
+    assert notifier.coalesced == 1
+    assert notifier.latency is not None
+    assert all(b - a >= 0.045 for a, b in zip(times, times[1:]))
+
+
+def test_notifier_failed(capsys):
+    def send(summary, body, timeout=None, urgent=False):
+        raise OSError('no daemon')
+
+    notifier = tider.Notifier(send, min_interval=0)
+    notifier.notify('Take a break!')
+    deadline = time.time() + 2
+    while not notifier.sent and time.time() < deadline:
+        time.sleep(0.01)
+    assert notifier.sent == 1
+    assert 'Notification is failed' in capsys.readouterr().err
+
+
+def test_state_overwork(conf, clock):
+    notifier = Notifier()
+    state = tider.State(conf, notifier)
+    state.set_activity(True, 'pusto@dev')
+    for i in range(conf.work_period // 200 + 1):
+        clock.tick(200)
+        state.refresh()
+    assert notifier.sent == ['Take a break!']
+
+    # Repeated after `overwork_period`
+    clock.tick(conf.overwork_period - 1)
+    state.refresh()
+    assert notifier.sent == ['Take a break!']
+    clock.tick(2)
+    state.refresh()
+    assert notifier.sent == ['Take a break!'] * 2
+
+
+class Handler:
+    def __init__(self):
+        self.calls = []
+
+    def pub_target(self, name=None):
+        self.calls.append(name)
+
+    def pub_ping(self):
+        return 'pong'
+
+
+async def dispatch(action, *args):
+    return action(*args)
+
+
+async def start_server(server):
+    task = asyncio.ensure_future(server.serve())
+    while not os.path.exists(server.address):
+        await asyncio.sleep(0.01)
+    return task
+
+
+async def stop_server(task):
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+
+async def request(address, *chunks):
+    reader, writer = await asyncio.open_unix_connection(address)
+    for chunk in chunks:
+        writer.write(chunk)
+        await writer.drain()
+        await asyncio.sleep(0.01)
+    writer.write_eof()
+    data = await reader.read()
+    writer.close()
+    return data
+
+
+def test_server(tmp_path):
+    handler = Handler()
+    address = str(tmp_path / 'socket')
+    server = tider.Server(address, handler, dispatch)
+
+    async def main():
+        task = await start_server(server)
+
+        # Lines are split by bytes, a character can be in two packets
+        data = await request(
+            address,
+            'target pusto@d'.encode() + 'é'.encode()[:1],
+            'é'.encode()[1:] + b'v\nping\n\xff\n\nwrong\n'
+        )
+        assert [json.loads(i) for i in data.splitlines()] == [
+            {'ok': True, 'result': None},
+            {'ok': True, 'result': 'pong'},
+            {'ok': False, 'error': 'Wrong encoding'},
+            {'ok': False, 'error': 'Wrong action: wrong'},
+        ]
+        assert handler.calls == ['pusto@dév']
+
+        # A line can be in many packets too
+        data = await request(address, b'tar', b'get lal', b'@mix\n')
+        assert json.loads(data) == {'ok': True, 'result': None}
+        assert handler.calls[-1] == 'lal@mix'
+
+        # Old clients send a bare action
+        assert await request(address, b'ping') == b'OK'
+        assert await request(address, b'wrong') == b''
+
+        await stop_server(task)
+
+    asyncio.run(main())
+
+
+def test_state_timeout(conf, clock):
+    state = tider.State(conf, Notifier())
+    state.set_activity(True, 'pusto@dev')
+    clock.tick(10)
+    state.refresh()
+    # The shown duration is changed by `text_precision`
+    assert state.get_timeout() == 50
+
+    # The work period is about to end
+    while clock.now < state.start + conf.work_period - 5:
+        clock.tick(min(100, state.start + conf.work_period - 5 - clock.now))
+        state.refresh()
+    assert state.get_timeout() == 5
+
+    # Not less than `update_period`
+    clock.tick(4.9)
+    state.refresh()
+    assert state.get_timeout() == conf.update_period / 1000
+
+
+def test_state_stats_precision(conf, clock):
+    state = tider.State(conf, Notifier())
+    state.set_activity(True, 'pusto@dev')
+    clock.tick(130)
+    state.refresh()
+    stats = state.stats
+    assert '<b>pusto@dev: 2m</b>' in stats
+
+    # Nothing is changed till the next step
+    clock.tick(40)
+    state.refresh()
+    assert state.stats == stats
+    clock.tick(20)
+    state.refresh()
+    assert '<b>pusto@dev: 3m</b>' in state.stats
+
+
+def test_state_offline(conf, clock):
+    state = tider.State(conf, Notifier())
+    state.set_activity(True, 'pusto@dev')
+    start = clock.now
+    clock.tick(200)
+    state.refresh()
+
+    # Suspended computer: the activity is ended at the last tick
+    clock.tick(conf.offline_timeout + 1)
+    state.refresh()
+    assert state.start is None
+    assert get_rows(conf) == [('pusto@dev', start, start + 200, 200, 0)]
+
+
+def test_state_idle(conf, clock):
+    idle = Clock(0)
+    calls = []
+    source = lambda: calls.append(idle()) or idle()
+
+    state = tider.State(conf, Notifier(), source)
+    state.set_activity(True, 'pusto@dev')
+    start = clock.now
+    for i in range(20):
+        clock.tick(60)
+        # No user input after 5 minutes of work
+        idle.tick(60 if i >= 5 else 0)
+        state.refresh()
+    assert state.start is None
+    assert get_rows(conf) == [('pusto@dev', start, start + 300, 300, 0)]
+    # Idle time can't reach the timeout sooner, so the source is rare
+    assert calls == [0, 300, 600]
+
+
+def test_state_idle_break(conf, clock):
+    # A break isn't ended by idle time, unknown idle time is ignored
+    idle = Clock(None)
+    state = tider.State(conf, Notifier(), idle)
+    state.set_activity(True, 'pusto@dev')
+    for i in range(20):
+        clock.tick(60)
+        state.refresh()
+    assert state.active
+
+    idle.now = 10 ** 6
+    state.set_activity(False)
+    for i in range(20):
+        clock.tick(60)
+        state.refresh()
+    assert state.start and not state.active
+
+
+@pytest.mark.parametrize('format', sorted(tider.LOG_FORMATS))
+def test_export_import(tmp_path, capsys, format):
+    rows = [
+        ('pusto@dev', 1500000000, 1500001000, 1000, 0),
+        ('лал@mix', 1500002000, 1500002500, 0, 500),
+        ('@surf', 1500003000, None, None, None),
+    ]
+    src = get_conf(tmp_path / 'src')
+    insert_rows(src, rows)
+    path = str(tmp_path / ('log.' + format))
+    tider.export_log(src, path, format)
+
+    dst = get_conf(tmp_path / 'dst')
+    tider.import_log(dst, path, format)
+    assert get_rows(dst) == get_rows(src)
+
+    # Import can be repeated
+    tider.import_log(dst, path, format)
+    assert get_rows(dst) == get_rows(src)
+    check_totals(dst)
+    assert 'Imported 0 of 3 rows (3 already exist)' in capsys.readouterr().err
+
+
+def test_import_wrong_rows(conf, tmp_path):
+    path = str(tmp_path / 'log.csv')
+    with open(path, 'w') as f:
+        f.write('target,start,end,work,break\npusto@dev,1,2,1,0\nlal,3,4\n')
+    with pytest.raises(SystemExit, match='line 3'):
+        tider.import_log(conf, path, 'csv')
+
+    path = str(tmp_path / 'log.bin')
+    with open(path, 'wb') as f:
+        rows = [('pusto@dev', 1, 2, 1, 0), ('lal@mix', 3, 4, 1, 0)]
+        list(tider.dump_bin(rows, f))
+        f.truncate(f.tell() - 3)
+    offset = len(tider.BIN_HEADER) + struct.calcsize(tider.BIN_ROW) + 9
+    with pytest.raises(SystemExit, match='offset %s' % offset):
+        tider.import_log(conf, path, 'bin')
+
+    path = str(tmp_path / 'log.jsonl')
+    for line in ['{"target": "lal", ', '[1, 2]', '{"start": 3}',
+                 '{"target": "", "start": 3}', '{"target": "lal"}']:
+        with open(path, 'w') as f:
+            f.write('{"target": "pusto@dev", "start": 1}\n\n%s\n' % line)
+        with pytest.raises(SystemExit, match='Wrong JSON row on line 3'):
+            tider.import_log(conf, path, 'jsonl')
+
+    # Rows without target or start aren't counted as existing ones
+    path = str(tmp_path / 'log.csv')
+    for row in [',3,4,1,0', 'lal,,4,1,0']:
+        with open(path, 'w') as f:
+            f.write('target,start,end,work,break\npusto@dev,1,2,1,0\n')
+            f.write(row + '\n')
+        with pytest.raises(SystemExit, match='line 3'):
+            tider.import_log(conf, path, 'csv')
+
+    path = str(tmp_path / 'log.bin')
+    with open(path, 'wb') as f:
+        rows = [('pusto@dev', 1, 2, 1, 0), ('', 3, 4, 1, 0)]
+        list(tider.dump_bin(rows, f))
+    with pytest.raises(SystemExit, match='offset %s' % offset):
+        tider.import_log(conf, path, 'bin')
+
+    # The import is one transaction
+    assert get_rows(conf) == []
+
+
+def create_db(path, rows):
+    db = sqlite3.connect(str(path))
+    tider.init_db(db)
+    db.executemany(
+        'INSERT INTO log (%s) VALUES (?, ?, ?, ?, ?)'
+        % ', '.join(tider.LOG_FIELDS), rows
+    )
+    db.commit()
+    db.close()
+    return str(path)
+
+
+def get_merge_summary(capsys):
+    lines = capsys.readouterr().out.splitlines()
+    return [[int(i) for i in line.split('|')[1:]] for line in lines[1:]]
+
+
+def test_merge(conf, tmp_path, capsys):
+    insert_rows(conf, [
+        ('pusto@dev', 1000, 2000, 1000, 0),
+        ('@surf', 3000, 4000, 0, 1000),
+    ])
+    path = create_db(tmp_path / 'laptop.db', [
+        ('pusto@dev', 1000, 2000, 1000, 0),  # duplicate
+        ('lal@mix', 1500, 2500, 1000, 0),  # trimmed
+        ('arch@tune', 3500, 3900, 400, 0),  # work over break
+        ('tider@dev', 1010, 1990, 980, 0),  # overlap
+        ('@fop', 5000, 6000, 1000, 0),  # new
+    ])
+
+    tider.merge_log(conf, [path])
+    assert get_rows(conf) == [
+        ('pusto@dev', 1000, 2000, 1000, 0),
+        ('lal@mix', 2000, 2500, 500, 0),
+        ('@surf', 3000, 4000, 0, 1000),
+        ('arch@tune', 3500, 3900, 400, 0),
+        ('@fop', 5000, 6000, 1000, 0),
+    ]
+    check_totals(conf)
+    # rows, merged, trimmed, duplicates, overlaps
+    assert get_merge_summary(capsys) == [[5, 2, 1, 1, 1]]
+
+    # Merged rows are duplicates or overlaps next time
+    tider.merge_log(conf, [path])
+    assert len(get_rows(conf)) == 5
+    assert get_merge_summary(capsys) == [[5, 0, 0, 3, 2]]
+
+    with pytest.raises(SystemExit, match='No such database'):
+        tider.merge_log(conf, [str(tmp_path / 'desktop.db')])
+
+
+def test_targets(conf, clock):
+    day = 24 * 60 * 60
+    rows = [('old@x', -60 * day + i * 3600, 3600) for i in range(10)]
+    rows += [('mid@x', -day + i * 60, 60) for i in range(3)]
+    rows += [('new@x', -400, 360)]
+    insert_rows(conf, [
+        (target, clock.now + start, clock.now + start + work, work, 0)
+        for target, start, work in rows
+    ])
+    check_totals(conf)
+
+    # Frecency: usages and worked hours halved by time since the last usage
+    state = tider.State(conf, Notifier())
+    assert state.get_targets() == ['mid@x', 'new@x', 'old@x']
+
+    # Saved activities are ranked at once
+    for i in range(3):
+        state.set_activity(True, 'fresh@x')
+        clock.tick(120)
+        state.set_activity(False)
+        clock.tick(120)
+    assert state.get_targets() == ['fresh@x', 'mid@x', 'new@x', 'old@x']
+    check_totals(conf)
+
+
+def test_matcher():
+    names = ['tider@dev', 'mail@work', 'dev@tider', 'tide@x', 'timer@dev']
+    matcher = tider.Matcher(names)
+    assert matcher.match('') == names
+    # Prefixes of names and of parts after separators in rank order
+    assert matcher.match('Ti') == [
+        'tider@dev', 'dev@tider', 'tide@x', 'timer@dev'
+    ]
+    assert matcher.match('dev') == ['tider@dev', 'dev@tider', 'timer@dev']
+    assert matcher.match('@w') == ['mail@work']
+    # Fuzzy matches by score, then by rank
+    assert matcher.match('td') == [
+        'timer@dev', 'tider@dev', 'dev@tider', 'tide@x'
+    ]
+    assert matcher.match('mwk') == ['mail@work']
+    assert matcher.match('ddd') == []
+
+    matcher = tider.Matcher(names, limit=2)
+    assert matcher.match('') == names[:2]
+    assert matcher.match('ti') == ['tider@dev', 'dev@tider']
+    assert matcher.match('td') == ['timer@dev', 'tider@dev']
+
+
+def test_tree():
+    rows = [
+        ('lal@mix', 50), ('pusto@dev', 300), ('a@b@c', 10),
+        ('pusto@mix', 100), ('lal', 20)
+    ]
+    # Work rolls up to prefixes, a single child without own work is joined
+    assert tider.get_tree(rows) == [
+        ('pusto', 400, 0),
+        ('pusto@dev', 300, 1),
+        ('pusto@mix', 100, 1),
+        ('lal', 70, 0),
+        ('lal@mix', 50, 1),
+        ('a@b@c', 10, 0),
+    ]
+    assert tider.get_tree([('a.b@c', 10), ('a.d', 5)], '.@') == [
+        ('a', 15, 0),
+        ('a.b@c', 10, 1),
+        ('a.d', 5, 1),
+    ]
+
+    report = tider.make_report(rows, ['2015-03-04'], tree='@')
+    assert report.total == 480
+    assert report.rows[0] == ('pusto', 400, 0)
+    text = tider.render_report(report)
+    assert text.splitlines()[3:6] == [
+        '|pusto |     6m 40s|',
+        '|  @dev|      5m 0s|',
+        '|  @mix|     1m 40s|',
+    ]
+
+
+def test_report_formats():
+    reports = [
+        tider.make_report([('lal@mix', 50.4), ('pusto@dev', 300)],
+                          ['2015-03-04'], tree='@'),
+        tider.make_report([], ['2015-03-05']),
+        tider.make_report([('pusto@dev', 300)], ['2015-03-04', '2015-03-05'],
+                          label='total'),
+    ]
+    assert json.loads(tider.render_json(reports)) == [
+        {
+            'from': '2015-03-04', 'to': '2015-03-04', 'label': None,
+            'total': 350,
+            'rows': [
+                {'target': 'pusto@dev', 'work': 300, 'depth': 0},
+                {'target': 'lal@mix', 'work': 50, 'depth': 0},
+            ]
+        },
+        {
+            'from': '2015-03-04', 'to': '2015-03-05', 'label': 'total',
+            'total': 300,
+            'rows': [{'target': 'pusto@dev', 'work': 300, 'depth': 0}]
+        },
+    ]
+    assert len(json.loads(tider.render_json(reports, quiet=False))) == 3
+
+    assert tider.render_csv(reports).splitlines() == [
+        'from,to,label,target,work,depth',
+        '2015-03-04,2015-03-04,,pusto@dev,300,0',
+        '2015-03-04,2015-03-04,,lal@mix,50,0',
+        '2015-03-04,2015-03-05,total,pusto@dev,300,0',
+    ]
+
+
+def test_perf(monkeypatch):
+    now = [0]
+    monkeypatch.setattr(tider.time, 'perf_counter', lambda: now[0])
+
+    def run(perf, name, duration, queries=0):
+        with perf(name):
+            now[0] += duration
+            perf.queries += queries
+
+    perf = tider.Perf()
+    run(perf, 'refresh', 1)
+    assert not perf.ring and perf.summary() == {}
+
+    perf.enable(3)
+    for duration in [0.002, 0.02, 0.00005, 0.004]:
+        run(perf, 'refresh', duration, queries=1)
+    run(perf, 'save_log', 0.5, queries=3)
+    summary = perf.summary()
+    # Only the last three are kept, but all calls are counted
+    assert summary['refresh'] == {
+        'calls': 4, 'count': 2, 'mean': 2.025, 'p50': 4.0, 'p99': 4.0,
+        'max': 4.0, 'queries': 1, 'steps': 0, 'hist': {'100us': 1, '10ms': 1}
+    }
+    assert summary['save_log'] == {
+        'calls': 1, 'count': 1, 'mean': 500.0, 'p50': 500.0, 'p99': 500.0,
+        'max': 500.0, 'queries': 3, 'steps': 0, 'hist': {'1s': 1}
+    }
+
+
+def test_subscribe(tmp_path):
+    address = str(tmp_path / 'socket')
+    server = tider.Server(address, Handler(), dispatch)
+
+    async def main():
+        task = await start_server(server)
+        reader, writer = await asyncio.open_unix_connection(address)
+        writer.write(b'subscribe\n')
+        await writer.drain()
+
+        # Nothing is sent till the first status
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(reader.readline(), 0.05)
+        server.publish({'text': 'pusto@dev'})
+        line = await asyncio.wait_for(reader.readline(), 1)
+        assert json.loads(line)['result'] == {'text': 'pusto@dev'}
+
+        # A slow client gets only the latest status
+        server.publish({'text': 'lal@mix'})
+        server.publish({'text': 'off'})
+        line = await asyncio.wait_for(reader.readline(), 1)
+        assert json.loads(line)['result'] == {'text': 'off'}
+        assert len(server.subscribers) == 1
+
+        writer.close()
+        await stop_server(task)
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize('name, value', [
+    ('update_period', '1'),
+    ('update_period', 0),
+    ('min_duration', -1),
+    ('hide_tray', 1),
+    ('break_symbol', ''),
+    ('text_hook', 'pusto'),
+])
+def test_config_wrong(tmp_path, name, value):
+    with pytest.raises(ValueError, match='Wrong value of "%s"' % name):
+        get_conf(tmp_path, **{name: value})
+
+
+def test_config_cache(tmp_path):
+    conf = get_conf(tmp_path, break_symbol='+')
+    conf.db.close()
+    assert conf.break_symbol == '+'
+    assert os.path.exists(tmp_path / 'config.cache')
+
+    # Cached code is used till "config.py" is changed
+    conf = get_conf(tmp_path, break_symbol='#', min_duration=5)
+    conf.db.close()
+    assert (conf.break_symbol, conf.min_duration) == ('#', 5)
+    os.remove(tmp_path / 'config.py')
+    conf = tider.get_config(str(tmp_path))
+    conf.db.close()
+    assert conf.break_symbol == '*' and conf.min_duration == 60
+
+
+class Reloader(tider.App):
+    def __init__(self, conf):
+        self.conf = conf
+        self.state = tider.State(conf, Notifier())
+
+    def update(self):
+        self.state.refresh()
+
+
+def test_reload(conf, clock):
+    app = Reloader(conf)
+    app.pub_target('pusto@dev')
+    assert '0:00 pusto@dev' in app.state.text
+
+    with open(os.path.join(conf.conf_dir, 'config.py'), 'w') as f:
+        f.write('min_duration = 5\ndef text_hook(ctx):\n    return ctx.x\n')
+    clock.tick(60)
+    with pytest.raises(AttributeError):
+        app.pub_reload()
+    # The old config is back
+    assert app.conf is conf and app.state.conf is conf
+    assert '0:01 pusto@dev' in app.state.text
+
+    with open(os.path.join(conf.conf_dir, 'config.py'), 'w') as f:
+        f.write('text_precision = 0\n')
+    with pytest.raises(ValueError, match='text_precision'):
+        app.pub_reload()
+    assert app.conf is conf
+
+    with open(os.path.join(conf.conf_dir, 'config.py'), 'w') as f:
+        f.write('min_duration = 5\n')
+    app.pub_reload()
+    assert app.conf.min_duration == 5 and app.state.conf is app.conf
+    assert app.conf.db is conf.db
+    assert (app.state.target, app.state.active) == ('pusto@dev', True)
+
+
+def test_merge_many(conf, tmp_path, capsys):
+    # SQLite allows only 10 attached databases
+    paths = [
+        create_db(tmp_path / ('%s.db' % i), [('pusto@dev', i, i + 1, 1, 0)])
+        for i in range(12)
+    ]
+    tider.merge_log(conf, paths)
+    assert len(get_rows(conf)) == 12
+    assert get_merge_summary(capsys)[-1] == [12, 12, 0, 0, 0]
+
+    bad = tmp_path / 'bad.db'
+    bad.write_bytes(b'not a database' * 100)
+    with pytest.raises(SystemExit, match='Wrong database %s' % bad):
+        tider.merge_log(conf, [paths[0], str(bad)])
+    # Nothing is left attached after the failure
+    tider.merge_log(conf, [paths[0]])
+    assert get_merge_summary(capsys) == [[1, 0, 0, 1, 0]]
+    check_totals(conf)
+
+
+def test_watch(monkeypatch, capsys):
+    # Instance isn't running, then it is started and restarted
+    streams = iter([[], [], [], [{'text': 'a'}, {'text': 'b'}], [], []])
+    monkeypatch.setattr(tider, 'subscribe', lambda address: next(streams))
+    delays = []
+
+    def sleep(delay):
+        delays.append(delay)
+        if len(delays) == 6:
+            raise KeyboardInterrupt
+
+    monkeypatch.setattr(tider.time, 'sleep', sleep)
+    with pytest.raises(KeyboardInterrupt):
+        tider.watch('socket')
+    assert delays == [1, 2, 4, 1, 2, 4]
+    lines = capsys.readouterr().out.splitlines()
+    assert [json.loads(i.rstrip(',')) for i in lines[2:]] == [
+        [],
+        [{'name': 'tider', 'full_text': 'a', 'markup': 'pango'}],
+        [{'name': 'tider', 'full_text': 'b', 'markup': 'pango'}],
+        [],
+    ]
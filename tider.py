@@ -1,41 +1,48 @@
-import argparse
-import datetime as dt
 import hashlib
-import math
+import io
+import json
 import os
-import pickle
 import re
 import socket
-import sqlite3
-import subprocess as sp
 import sys
 import time
-from collections import namedtuple
+from bisect import bisect_left
+from collections import OrderedDict, deque, namedtuple
 from contextlib import contextmanager
-from threading import Thread
+from functools import wraps
+from threading import Condition, Lock, Thread, local
 
-import gi
-gi.require_version('Gdk', '3.0')  # noqa
-gi.require_version('Gtk', '3.0')  # noqa
-
-from gi.repository import Gdk, Gtk, GObject
-
-GObject.threads_init()
+# Modules needed only by some commands are imported in place, so CLI
+# starts faster. GTK is imported only by GUI, see `import_gtk`
+Gdk = Gtk = GObject = None
 
 OK = 'OK'
-RELOAD = 100
+RESTART = 100
 SQL_DATE = '%Y-%m-%d'
+LOG_FIELDS = ('target', 'start', 'end', 'work', 'break')
+FRECENCY_HALF_LIFE = 7 * 24 * 60 * 60
+Duration = namedtuple('Duration', 'h m s')
+Report = namedtuple('Report', 'interval label rows total')
+Last = namedtuple('Last', (
+    'period need_break started started_str ended ended_str'
+))
 DEFAULT_CONFIG = '''
-update_period = 1000  # in microseconds
+update_period = 1000  # minimal, in milliseconds
+text_precision = 60  # how often text changes, in seconds
 offline_timeout = 300  # in seconds
+idle_timeout = 600  # without user input, in seconds (0 to disable)
+checkpoint_period = 60  # in seconds
 min_duration = 60  # in seconds
 break_symbol = '*'
+target_separators = '@'
 break_period = 600  # in seconds
 work_period = 3000  # in seconds
 overwork_period = 300  # in seconds
 hide_tray = True
 hide_win = False
 sqlite_manager = 'sqlite3'
+perf_size = 1000  # timings kept for "tider call perf" (0 to disable)
+perf_dump = None  # path to save perf stats on quit
 
 
 # Update window after creation
@@ -55,66 +62,226 @@ def text_hook(ctx):
 '''.strip()
 
 
-class Gui:
-    def __init__(self, conf):
+def import_gtk():
+    global Gdk, Gtk, GObject
+
+    import gi
+    gi.require_version('Gdk', '3.0')
+    gi.require_version('Gtk', '3.0')
+
+    from gi.repository import Gdk, Gtk, GObject
+
+    GObject.threads_init()
+
+
+def timed(name):
+    '''Record calls of a method to `self.conf.perf`'''
+    def wrapper(func):
+        @wraps(func)
+        def inner(self, *args, **kwargs):
+            perf = self.conf.perf
+            mark = perf.start()
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                perf.stop(name, mark)
+        return inner
+    return wrapper
+
+
+class App:
+    '''Running instance: `State` and actions served via the socket
+
+    Subclasses run a loop and define:
+    - `update()` refreshes `State` and shows it, called when it changes;
+    - `async dispatch(action, *args)` runs an action in the loop;
+    - `pub_quit()` stops the loop, it is an action too.
+    '''
+    def __init__(self, conf, notifier=None):
+        # Only running instance records, before any connection is open
+        conf.perf.enable(conf.perf_size)
+
         if os.path.exists(conf.socket):
             if send_action(conf.socket, 'ping') == OK:
-                print('Another `tider` instance already run.')
+                print('Another `tider` instance already run.', file=sys.stderr)
                 raise SystemExit(1)
             else:
                 os.remove(conf.socket)
 
-        self.reload = False
+        self.restart = False
+        self.timer = None
+        self.rendered = {}
+        self.render_stats = {'updated': 0, 'skipped': 0}
         self.conf = conf
-        self.state = State(conf)
+        self.state = State(conf, notifier, get_idle())
+        self.server = Server(conf.socket, self, self.dispatch)
 
-        self.menu = menu = self.create_menu()
-        win = self.create_win(menu) if not conf.hide_win else None
-        tray = self.create_tray(menu) if not conf.hide_tray else None
+    def close(self):
+        if self.restart:
+            self.state.save()
+        else:
+            self.state.disable()
+        if self.conf.perf_dump:
+            with open_via_tmpfile(self.conf.perf_dump, mode='w') as f:
+                f.write(json.dumps(self.pub_perf(), indent=2))
+        self.conf.db.close()
+
+        # stdout can be used for status by `Daemon`
+        if self.restart:
+            print('Tider restarting...', file=sys.stderr)
+            raise SystemExit(RESTART)
+        print('Tider closed.', file=sys.stderr)
+
+    def publish(self):
+        '''Send status to subscribers of the socket if it is changed'''
+        state = self.state
+        self.render('status', self.server.publish, {
+            'text': state.text,
+            'target': state.target,
+            'active': state.active,
+            'start': state.start,
+            'duration': state.duration and state.duration._asdict(),
+            'stats': state.stats,
+        })
 
-        def update():
-            self.state.refresh()
-            menu.update()
-            if win:
-                win.update()
-            if tray:
-                tray.update()
-            return True
+    def render(self, key, setter, value):
+        '''Call `setter` only if `value` is changed since last call'''
+        if key in self.rendered and self.rendered[key] == value:
+            self.render_stats['skipped'] += 1
+            return
+
+        self.rendered[key] = value
+        self.render_stats['updated'] += 1
+        setter(value)
+
+    def parse_target(self, text):
+        '''Name with trailing `break_symbol` means a break'''
+        target = text.strip()
+        active = not target.endswith(self.conf.break_symbol)
+        if not active:
+            target = target.rstrip(' ' + self.conf.break_symbol)
+        return target, active
+
+    def pub_target(self, name=None):
+        target, active = self.parse_target(name or '')
+        if not target:
+            raise ValueError('Target name is required')
+
+        self.state.set_activity(active, target=target)
+        self.update()
+
+    def pub_disable(self):
+        self.state.disable()
+        self.update()
+
+    def pub_reload(self):
+        '''Apply changed config in place, the current activity is kept
+
+        The window and the tray are created only at start, so `hide_win`,
+        `hide_tray` and `win_hook` are applied by restart.
+        '''
+        old, conf = self.conf, get_config(self.conf.conf_dir, self.conf)
+        self.configure(conf)
+        try:
+            self.update()
+        except Exception:
+            # Hooks can fail only at runtime, so the old config is back
+            self.configure(old)
+            self.update()
+            raise
+
+    def configure(self, conf):
+        self.conf = conf
+        self.state.configure(conf)
+
+    def pub_restart(self):
+        self.restart = True
+        self.pub_quit()
+
+    def pub_ping(self):
+        pass
+
+    def pub_perf(self):
+        perf, notifier = self.conf.perf, self.state.notifier
+        return {
+            'timings': perf.summary(),
+            'sql': {
+                'connections': self.conf.db.count,
+                'queries': perf.queries,
+                'steps': perf.steps,
+            },
+            'render': self.render_stats,
+            'notifier': {
+                'latency': notifier.latency,
+                'sent': notifier.sent,
+                'coalesced': notifier.coalesced,
+            },
+        }
 
-        update()
-        GObject.timeout_add(conf.update_period, update)
+
+class Gui(App):
+    def __init__(self, conf):
+        import_gtk()
+        super().__init__(conf, Notifier(get_libnotify()))
+
+        self.matcher = None
+        self.matcher_lock = Lock()
+        self.menu = menu = self.create_menu()
+        self.win = self.create_win(menu) if not conf.hide_win else None
+        self.tray = self.create_tray(menu) if not conf.hide_tray else None
+        self.update()
 
         # Start GTK loop
-        server = Thread(target=self.serve, args=(conf.socket,))
-        server.daemon = True
-        server.start()
+        Thread(target=self.server.run, daemon=True).start()
 
         try:
             Gtk.main()
         finally:
-            if self.reload:
-                print('Tider reloading...')
-                raise SystemExit(RELOAD)
+            self.close()
+
+    @timed('gui.update')
+    def update(self):
+        '''Refresh state and widgets, then sleep till the next change'''
+        self.state.refresh()
+        with self.conf.perf('gui.widgets'):
+            self.menu.update()
+            if self.win:
+                self.win.update()
+            if self.tray:
+                self.tray.update()
+        self.publish()
+
+        timeout = int(self.state.get_timeout() * 1000)
+        if self.timer:
+            GObject.source_remove(self.timer)
+        self.timer = GObject.timeout_add(timeout, self.tick)
+
+    def tick(self):
+        self.timer = None
+        self.update()
+        return False
+
+    async def dispatch(self, action, *args):
+        '''Run `action` in GTK loop, it is awaited by the server thread'''
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        result = loop.create_future()
+
+        def done(set_result, value):
+            if not result.done():
+                set_result(value)
+
+        def run():
+            try:
+                value = action(*args)
+            except Exception as e:
+                loop.call_soon_threadsafe(done, result.set_exception, e)
             else:
-                self.state.disable()
-                print('Tider closed.')
-
-    def serve(self, address):
-        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        s.bind(address)
-        s.listen(1)
+                loop.call_soon_threadsafe(done, result.set_result, value)
 
-        while True:
-            conn, addr = s.accept()
-            while True:
-                data = conn.recv(1024)
-                if not data:
-                    break
-                action = data.decode()
-                action = getattr(self, 'pub_' + action)
-                GObject.idle_add(action)
-                conn.send(OK.encode())
-        conn.close()
+        GObject.idle_add(run)
+        return await result
 
     def create_tray(self, menu):
         tray = Gtk.StatusIcon()
@@ -125,13 +292,16 @@ class Gui:
         ))
 
         def update():
-            tray.set_tooltip_markup(self.state.stats)
+            self.render('tray.tooltip', tray.set_tooltip_markup, (
+                self.state.stats
+            ))
             if not self.state.start:
-                tray.set_from_stock(Gtk.STOCK_MEDIA_STOP)
+                icon = Gtk.STOCK_MEDIA_STOP
             elif self.state.active:
-                tray.set_from_stock(Gtk.STOCK_MEDIA_PLAY)
+                icon = Gtk.STOCK_MEDIA_PLAY
             else:
-                tray.set_from_stock(Gtk.STOCK_MEDIA_PAUSE)
+                icon = Gtk.STOCK_MEDIA_PAUSE
+            self.render('tray.icon', tray.set_from_stock, icon)
 
         tray.update = update
         return tray
@@ -153,8 +323,10 @@ class Gui:
         box.connect('button-press-event', lambda w, e: menu.popup_default(e))
 
         def update():
-            label.set_markup(self.state.text)
-            label.set_tooltip_markup(self.state.stats)
+            self.render('win.text', label.set_markup, self.state.text)
+            self.render('win.tooltip', label.set_tooltip_markup, (
+                self.state.stats
+            ))
 
         win.update = update
         return win
@@ -162,7 +334,7 @@ class Gui:
     def create_menu(self):
         off = Gtk.ImageMenuItem.new_from_stock(Gtk.STOCK_MEDIA_STOP, None)
         off.set_label('Switch off')
-        off.connect('activate', lambda w: self.state.disable())
+        off.connect('activate', lambda w: self.pub_disable())
 
         target = Gtk.ImageMenuItem.new_from_stock(Gtk.STOCK_OK, None)
         target.set_label('Set activity')
@@ -187,10 +359,8 @@ class Gui:
             menu.append(i)
 
         def update():
-            if not self.state.start:
-                off.hide()
-            else:
-                off.show()
+            show = lambda v: off.show() if v else off.hide()
+            self.render('menu.off', show, bool(self.state.start))
 
         def popup_default(e=None):
             if e:
@@ -205,6 +375,9 @@ class Gui:
         return menu
 
     def pub_report(self):
+        GObject.idle_add(self.show_report)
+
+    def show_report(self):
         dialog = Gtk.MessageDialog()
         dialog.add_button(Gtk.STOCK_OK, Gtk.ResponseType.OK)
         dialog.set_markup(self.state.stats)
@@ -213,27 +386,55 @@ class Gui:
             if not dialog.is_visible() or not self.state.start:
                 return False
 
-            dialog.set_markup(self.state.stats)
+            dialog.set_markup(self.state.get_stats())
             return True
 
         GObject.timeout_add(1000, update)
         dialog.run()
         dialog.destroy()
 
-    def get_completion(self):
-        db, cursor = self.conf.db()
-        cursor.execute(
-            '''
-            SELECT DISTINCT target FROM log
-                GROUP BY target
-                ORDER BY start DESC
-            '''
-        )
-        names = cursor.fetchall()
+    def get_matcher(self, names):
+        # The matcher is reused till the ranked targets are changed
+        with self.matcher_lock:
+            if not self.matcher or self.matcher.names is not names:
+                self.matcher = Matcher(names, self.conf.target_separators)
+            return self.matcher
+
+    def get_completion(self, entry):
+        '''Model contains only the best matches, they are found in thread'''
+        names = self.state.get_targets()
         liststore = Gtk.ListStore(str)
-        for n in names:
-            liststore.append(n)
+        for n in names[:10]:
+            liststore.append([n])
+
+        def show(query, names):
+            if entry.get_text() == query:
+                liststore.clear()
+                for n in names:
+                    liststore.append([n])
+                completion.complete()
+            return False
+
+        def search():
+            matcher = self.get_matcher(names)
+            while True:
+                query = queries.get()
+                # Only the latest query matters, others are outdated
+                while query is not None and not queries.empty():
+                    query = queries.get()
+                if query is None:
+                    return
+                GObject.idle_add(show, query, matcher.match(query))
+
+        from queue import Queue
+
+        queries = Queue()
+        Thread(target=search, daemon=True).start()
+        entry.connect('changed', lambda w: queries.put(w.get_text()))
+        entry.connect('destroy', lambda w: queries.put(None))
+
         completion = Gtk.EntryCompletion(model=liststore)
+        completion.set_match_func(lambda *a: True, None)
         completion.set_text_column(0)
         completion.set_minimum_key_length(0)
         completion.set_popup_completion(True)
@@ -242,7 +443,19 @@ class Gui:
         completion.set_inline_selection(True)
         return completion
 
-    def pub_target(self):
+    def pub_target(self, name=None):
+        if not name:
+            GObject.idle_add(self.show_target)
+            return
+
+        super().pub_target(name)
+
+    def configure(self, conf):
+        # Target separators can be changed
+        self.matcher = None
+        super().configure(conf)
+
+    def show_target(self):
         dialog = Gtk.Dialog()
         box = dialog.get_content_area()
         press_enter = lambda w, e: (
@@ -254,9 +467,10 @@ class Gui:
         label.set_markup('<b>Activity:</b>')
         box.pack_start(label, True, True, 6)
 
-        name = Gtk.Entry(completion=self.get_completion())
+        name = Gtk.Entry()
         name.set_max_length(20)
         name.set_text(self.state.target or 'Enter name...')
+        name.set_completion(self.get_completion(name))
         name.connect('key-press-event', press_enter)
         box.add(name)
 
@@ -283,10 +497,7 @@ class Gui:
         response = dialog.run()
 
         if response == Gtk.ResponseType.OK:
-            target = name.get_text().strip()
-            active = not target.endswith(self.conf.break_symbol)
-            if not active:
-                target = target.rstrip(' ' + self.conf.break_symbol)
+            target, active = self.parse_target(name.get_text())
             if not target:
                 pass
             elif start.get_active():
@@ -299,31 +510,114 @@ class Gui:
                 self.state.disable()
             else:
                 raise ValueError('wrong state')
+            self.update()
 
         dialog.destroy()
 
     def pub_menu(self):
         self.menu.popup_default()
 
-    def pub_disable(self):
-        self.state.disable()
-
     def pub_quit(self):
         os.remove(self.conf.socket)
         Gtk.main_quit()
 
-    def pub_reload(self):
-        self.reload = True
-        self.pub_quit()
 
-    def pub_ping(self):
-        pass
+class Daemon(App):
+    '''Run without GTK, `State` is driven by asyncio loop
+
+    Socket actions are the same as of `Gui` except of dialogs and menu,
+    `report` returns the statistics markup. `text_hook` result is written
+    to `output` file on change or printed to stdout line by line.
+    '''
+    def __init__(self, conf, output=None):
+        import asyncio
+
+        super().__init__(conf, Notifier())
+        self.output = output
+        self.loop = None
+        self.stopped = None
+        try:
+            asyncio.run(self.run())
+        finally:
+            self.close()
+
+    async def run(self):
+        import asyncio
+        import signal
+
+        self.loop = asyncio.get_running_loop()
+        self.stopped = self.loop.create_future()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            self.loop.add_signal_handler(sig, self.pub_quit)
+
+        serve = asyncio.ensure_future(self.server.serve())
+        self.update()
+        done, pending = await asyncio.wait(
+            [serve, self.stopped], return_when=asyncio.FIRST_COMPLETED
+        )
+        serve.cancel()
+        for future in done:
+            future.result()
+
+    @timed('daemon.update')
+    def update(self):
+        self.state.refresh()
+        self.render('text', self.write, self.state.text)
+        self.publish()
+
+        timeout = self.state.get_timeout()
+        if self.timer:
+            self.timer.cancel()
+        self.timer = self.loop.call_later(timeout, self.update)
+
+    def write(self, text):
+        if not self.output or self.output == '-':
+            print(text, flush=True)
+            return
+
+        with open_via_tmpfile(self.output, mode='w') as f:
+            f.write(text)
+
+    async def dispatch(self, action, *args):
+        '''Actions are run right in the loop of the server'''
+        return action(*args)
+
+    def pub_report(self):
+        return self.state.get_stats()
+
+    def pub_quit(self):
+        if not self.stopped.done():
+            os.remove(self.conf.socket)
+            self.stopped.set_result(None)
+
+
+class Ctx:
+    '''Argument of `text_hook`
+
+    - `target`, `active`, `start`, `last` are the current activity
+    - `duration` is `Duration(h, m, s)` of the activity (or of the break
+      after the last working period if tider is disabled)
+    - `stats` is the statistics markup, the same as in tooltip
+    - `conf` is the config and `open` is `open_via_tmpfile`
+
+    The hook is called again only when `target`, `active`, `start`,
+    `duration` or `stats` are changed.
+    '''
+    __slots__ = 'target active start last duration stats conf open'.split()
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            setattr(self, name, value)
 
 
 class State:
-    __slots__ = '_path _data _last_overwork conf text stats'.split()
+    __slots__ = (
+        '_path _data _stamp _saved _cache _targets _version _last_overwork '
+        '_text_key _idle_check conf notifier idle text stats duration'
+        .split()
+    )
 
-    def __init__(self, conf):
+    def __init__(self, conf, notifier=None, idle=None):
         self._path = os.path.join(conf.conf_dir, 'last.txt')
         self._data = {
             'target': None,
@@ -331,31 +625,65 @@ class State:
             'start': None,
             'last': None
         }
+        self._stamp = None
+        self._saved = 0
+        self._cache = None
+        self._targets = None
+        self._version = None
         self._last_overwork = None
+        self._text_key = None
+        self._idle_check = 0
         self.conf = conf
+        self.notifier = notifier or Notifier()
+        self.idle = idle
         self.text = None
         self.stats = None
+        self.duration = None
 
         self.load()
 
     def __getattr__(self, name):
         return self._data[name]
 
+    def configure(self, conf):
+        '''Use new config, things computed with the old one are dropped'''
+        self.conf = conf
+        self._cache = None
+        self._text_key = None
+        self._idle_check = 0
+
     def update(self, **kwargs):
         self.load()
+        changed = {k for k, v in kwargs.items() if self._data[k] != v}
         self._data.update(**kwargs)
-        with open_via_tmpfile(self._path, mode='wb') as f:
+
+        # `last` is changed every tick, so it is only checkpointed
+        checkpoint = time.time() - self._saved > self.conf.checkpoint_period
+        if changed - {'last'} or changed and checkpoint:
+            self.save()
+
+    def save(self):
+        import pickle
+
+        with open_via_tmpfile(self._path, mode='wb', sync=True) as f:
             f.write(pickle.dumps(self._data))
+        self._stamp = get_stamp(self._path)
+        self._saved = time.time()
 
     def load(self):
-        state = {}
-        if os.path.exists(self._path):
-            with open(self._path, 'rb') as f:
-                try:
-                    state = pickle.load(f)
-                except Exception:
-                    state = {}
-                self._data.update(**state)
+        stamp = get_stamp(self._path)
+        if stamp is None or stamp == self._stamp:
+            return
+
+        import pickle
+
+        self._stamp = stamp
+        with open(self._path, 'rb') as f:
+            try:
+                state = pickle.load(f)
+            except Exception:
+                state = {}
+        self._data.update(**state)
 
     def set_activity(self, active, target=None, new=True):
         if not target:
@@ -365,6 +693,7 @@ class State:
             return
 
         if new:
+            self.touch()
             self.save_log()
             self.update(start=time.time(), last=None)
 
@@ -376,9 +705,19 @@ class State:
         self.refresh()
 
     def disable(self):
+        self.touch()
         self.save_log()
         self.reset()
 
+    def touch(self):
+        '''Set `last` to now, unless the computer was offline too long'''
+        if self.last and time.time() - self.last > self.conf.offline_timeout:
+            return False
+
+        self.update(last=time.time())
+        return True
+
+    @timed('save_log')
     def save_log(self):
         if not self.start:
             return
@@ -401,34 +740,149 @@ class State:
                 [self.target, self.start, self.last, work_time, break_time]
             )
             db.commit()
+            self.cache_log(self.target, self.start, self.last, work_time)
+
+    def check_changes(self):
+        '''Drop cached rows if the log is committed by another connection
+
+        `PRAGMA data_version` is changed only by commits of other connections
+        (`tider import`, `tider merge`, `tider db`, etc.), not by own ones.
+        '''
+        db, cursor = self.conf.db()
+        cursor.execute('PRAGMA data_version')
+        version = (db, cursor.fetchone()[0])
+        if version != self._version:
+            self._version = version
+            self._cache = self._targets = None
+
+    @timed('get_cache')
+    def get_cache(self):
+        '''Closed log rows needed for statistics, loaded once per day
+
+        Keeps today's work per target and working rows of the last 24 hours,
+        `save_log` adds new rows here, so a regular tick runs only one cheap
+        query of `check_changes`.
+        '''
+        today = time.strftime(SQL_DATE)
+        if self._cache and self._cache['day'] == today:
+            return self._cache
+
+        db, cursor = self.conf.db()
+        cursor.execute(
+            'SELECT start, end, work FROM log '
+            'WHERE start > ? AND work > 0 '
+            'ORDER BY start DESC',
+            [time.time() - 24 * 60 * 60]
+        )
+        rows = cursor.fetchall()
+        cursor.execute(
+            'SELECT target, work FROM daily_totals WHERE day = ?', [today]
+        )
+        self._cache = {'day': today, 'rows': rows, 'report': dict(cursor)}
+        return self._cache
+
+    @timed('get_targets')
+    def get_targets(self):
+        '''Target names ranked by frecency, the list is cached
+
+        Score is a number of usages plus worked hours, it is halved every
+        `FRECENCY_HALF_LIFE` seconds since the last usage.
+        '''
+        if self._targets is None:
+            db, cursor = self.conf.db()
+            cursor.execute(
+                'SELECT name, last_used, use_count, total_work FROM targets'
+            )
+            self._targets = {'rows': {r[0]: r[1:] for r in cursor}}
+
+        if not self._targets.get('ranked'):
+            now = time.time()
+            score = lambda r: (
+                (r[1][1] + r[1][2] / 3600) *
+                0.5 ** ((now - r[1][0]) / FRECENCY_HALF_LIFE)
+            )
+            rows = sorted(self._targets['rows'].items(), key=score)
+            self._targets['ranked'] = [r[0] for r in reversed(rows)]
+        return self._targets['ranked']
+
+    def cache_log(self, target, start, end, work):
+        if self._targets:
+            rows = self._targets['rows']
+            last_used, count, total = rows.get(target, (start, 0, 0))
+            rows[target] = (max(last_used, start), count + 1, total + work)
+            self._targets['ranked'] = None
+
+        if not self._cache:
+            return
+
+        cache = self._cache
+        if cache['day'] == time.strftime(SQL_DATE, time.localtime(start)):
+            cache['report'][target] = cache['report'].get(target, 0) + work
+        if work > 0:
+            cache['rows'].append((start, end, work))
+            cache['rows'].sort(key=lambda r: r[0], reverse=True)
+
+    def check_idle(self):
+        '''End working activity at the last user input if idle too long
+
+        Idle time can't reach `idle_timeout` sooner than `timeout - idle`
+        seconds, so the source isn't called till that moment.
+        '''
+        timeout = self.conf.idle_timeout
+        now = time.time()
+        if not (timeout and self.idle and self.active):
+            return False
+        elif now < self._idle_check:
+            return False
+
+        idle = self.idle()
+        if idle is None:
+            self._idle_check = now + timeout
+            return False
+        elif idle < timeout:
+            self._idle_check = now + timeout - idle
+            return False
+
+        self.update(last=now - idle)
+        self.save_log()
+        self.reset()
+        return True
 
+    @timed('refresh')
     def refresh(self):
-        if self.last and time.time() - self.last > self.conf.offline_timeout:
+        self.check_changes()
+        if not self.touch():
             return self.disable()
-
-        self.update(last=time.time())
+        elif self.check_idle():
+            return
 
         # Fill `stats` and `text` fields
-        self.stats = self.get_stats()
-
         last_working = self.get_last_working()
+        self.stats = self.get_stats(last_working)
+
         if self.start:
             duration = self.last - self.start
         elif last_working.ended:
             duration = time.time() - last_working.ended
         else:
             duration = 0
-        ctx = dict(self._data, **{
-            'duration': split_seconds(duration),
-            'stats': self.stats,
-            'active': self.active,
-
-            # useful stuff
-            'conf': self.conf,
-            'open': open_via_tmpfile,
-        })
-        ctx = namedtuple('Ctx', ctx.keys())(**ctx)
-        self.text = self.conf.text_hook(ctx)
+        duration = self.duration = split_seconds(duration)
+        key = (self.target, self.active, self.start, duration, self.stats)
+        if key != self._text_key:
+            with self.conf.perf('text_hook'):
+                self.text = self.conf.text_hook(Ctx(
+                    target=self.target,
+                    active=self.active,
+                    start=self.start,
+                    last=self.last,
+                    duration=duration,
+                    stats=self.stats,
+
+                    # useful stuff
+                    conf=self.conf,
+                    open=open_via_tmpfile,
+                ))
+            self._text_key = key
 
         # Handle overwork
         if self.conf.overwork_period and self.active:
@@ -451,14 +905,50 @@ class State:
                 if overtime:
                     message += '\nOverworking: ' + f_seconds(overtime)
 
-                cmd = 'notify-send -t %s %s "Take a break!" "%s"' % (
-                    int(self.conf.overwork_period * 500),
-                    '-u critical' if overtime > self.conf.work_period else '',
-                    message
+                self.notifier.notify(
+                    'Take a break!', message,
+                    timeout=self.conf.overwork_period / 2,
+                    urgent=overtime > self.conf.work_period
                 )
-                sp.call(cmd, shell=True)
 
-    def get_stats(self):
+    def get_timeout(self):
+        '''Seconds till anything visible can change'''
+        import datetime as dt
+
+        now = time.time()
+        last_w = self.get_last_working()
+        # The computer can be suspended, so the ticks shouldn't be rare
+        timeouts = [self.conf.offline_timeout / 2]
+
+        # Day is changed, so statistics too
+        tomorrow = dt.date.today() + dt.timedelta(days=1)
+        timeouts += [time.mktime(tomorrow.timetuple()) - now]
+
+        precision = self.conf.text_precision
+        begin = self.start or last_w.ended
+        if begin:
+            timeouts += [precision - (now - begin) % precision]
+        if self.active and last_w.period:
+            timeouts += [precision - last_w.period % precision]
+
+        if self.active and not last_w.need_break:
+            timeouts += [self.conf.work_period - last_w.period]
+        elif self.active and self._last_overwork:
+            overwork = self._last_overwork + self.conf.overwork_period
+            timeouts += [overwork - now]
+        elif not self.active and last_w.ended:
+            timeouts += [last_w.ended + self.conf.break_period - now]
+
+        if self.conf.idle_timeout and self.idle and self.active:
+            timeouts += [self._idle_check - now]
+
+        timeout = min(t for t in timeouts if t > 0)
+        return max(timeout, self.conf.update_period / 1000)
+
+    @timed('get_stats')
+    def get_stats(self, last_w=None):
+        # Live durations change only by `text_precision` like the ticks do
+        precision = self.conf.text_precision
         if not self.start:
             status = ('<b>Tider is disabled</b>')
         else:
@@ -469,17 +959,20 @@ class State:
                     state='working' if self.active else 'break',
                     target=self.target,
                     started=str_time(self.start),
-                    duration=str_seconds(time.time() - self.start)
+                    duration=str_seconds(time.time() - self.start, precision)
                 )
             )
         result = [status]
 
-        last_w = self.get_last_working()
+        if last_w is None:
+            last_w = self.get_last_working()
         if last_w.period:
             last_working = (
                 '<b>Last working period</b>\n'
                 '  <b>{period}</b>'
-                .format(period=str_seconds(last_w.period))
+                .format(period=str_seconds(
+                    last_w.period, precision if self.active else 1
+                ))
             )
             if self.active:
                 last_working += ' from {}'.format(last_w.started_str)
@@ -491,22 +984,16 @@ class State:
                 last_working += '\n  <b>Can work again!</b>'
             result += [last_working]
 
-        result += [get_report(self.conf)]
+        cache = self.get_cache()
+        report = make_report(list(cache['report'].items()), [cache['day']])
+        result += [render_report(report, markup=True)]
         result = '\n\n'.join(result)
         return result
 
+    @timed('get_last_working')
     def get_last_working(self):
-        db, cursor = self.conf.db()
-        cursor.execute(
-            'SELECT start, end, work FROM log '
-            'WHERE'
-            '   start > (strftime("%s", "now") - 24 * 60 * 60) '
-            '   AND work > 0 '
-            'ORDER BY start DESC'
-        )
-        rows = cursor.fetchall()
-
         now = time.time()
+        rows = [r for r in self.get_cache()['rows'] if r[0] > now - 24 * 3600]
         if self.active:
             rows.insert(0, (self.start, now, now - self.start))
 
@@ -524,98 +1011,741 @@ class State:
 
             if self.active or now - rows[0][1] < self.conf.break_period:
                 need_break = period > self.conf.work_period
-        last = {
-            'period': period, 'need_break': need_break,
-            'started': started, 'started_str': str_time(started),
-            'ended': ended, 'ended_str': str_time(ended)
-        }
-        return namedtuple('Last', last.keys())(**last)
+        return Last(
+            period=period, need_break=need_break,
+            started=started, started_str=str_time(started),
+            ended=ended, ended_str=str_time(ended)
+        )
+
+
+class Matcher:
+    '''Find names by prefix of the name or of its parts, then by fuzzy match
+
+    `names` are ranked, the first is the most relevant. Prefixes are
+    searched by bisect in sorted keys (the name and its suffixes starting
+    from separators). Fuzzy match checks only names with all letters of
+    the query, they are found by bitmasks of letters, in rank order and
+    stops when enough is found.
+    '''
+    def __init__(self, names, separators='@', limit=10):
+        self.names = names
+        self.separators = separators
+        self.limit = limit
+        self._lower = [n.lower() for n in names]
+        self._cache = {}
+
+        keys, ids, letters = [], [], {}
+        for i, name in enumerate(self._lower):
+            keys.append(name)
+            ids.append(i)
+            for c in set(name):
+                letters.setdefault(c, []).append(i)
+                if name.count(c) > 1:
+                    letters.setdefault(c * 2, []).append(i)
+                if c in separators:
+                    parts = name.split(c)
+                    for p in range(1, len(parts)):
+                        part = c.join(parts[p:])
+                        keys += [c + part, part]
+                        ids += [i, i]
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self._keys = [keys[i] for i in order]
+        self._ids = [ids[i] for i in order]
+
+        # Bit `i` is set if the name with rank `i` has the letter (or the
+        # letter twice for doubled keys)
+        self._masks = {}
+        for c, ids in letters.items():
+            mask = bytearray(len(names) // 8 + 1)
+            for i in ids:
+                mask[i >> 3] |= 1 << (i & 7)
+            self._masks[c] = int.from_bytes(mask, 'little')
+
+    def match(self, query):
+        import heapq
+
+        query = query.lower().strip()
+        if not query:
+            return self.names[:self.limit]
+        elif query in self._cache:
+            return self._cache[query]
+
+        lo = bisect_left(self._keys, query)
+        hi = bisect_left(self._keys, query + '\U0010ffff', lo)
+        ids = heapq.nsmallest(self.limit, set(self._ids[lo:hi]))
+        if len(ids) < self.limit:
+            skip = set(ids)
+            ids += [i for i in self.fuzzy(query) if i not in skip]
+
+        result = [self.names[i] for i in ids[:self.limit]]
+        if len(query) == 1:
+            self._cache[query] = result
+        return result
+
+    def fuzzy(self, query):
+        '''Names containing letters of `query` in the same order
 
+        Letters at the start of a part and sequences are scored higher.
+        '''
+        import heapq
 
-def get_config():
+        pattern = re.compile(
+            '.*?'.join('(%s)' % re.escape(c) for c in query), re.S
+        )
+        mask = -1
+        for c in set(query):
+            mask &= self._masks.get(c * min(query.count(c), 2), 0)
+        # Reversed binary string has the bit of rank `i` at index `i`
+        bits = bin(mask)[:1:-1]
+        found = []
+        i = bits.find('1')
+        while i >= 0:
+            name = self._lower[i]
+            match = pattern.search(name)
+            if not match:
+                i = bits.find('1', i + 1)
+                continue
+
+            score, prev = 0, None
+            for g in range(1, len(query) + 1):
+                p = match.start(g)
+                if p == 0 or name[p - 1] in self.separators:
+                    score += 2
+                if prev is not None and p == prev + 1:
+                    score += 1
+                prev = p
+            found.append((-score, i))
+            if len(found) >= self.limit * 3:
+                break
+            i = bits.find('1', i + 1)
+        return [i for score, i in heapq.nsmallest(self.limit, found)]
+
+
+class Notifier:
+    '''Send desktop notifications from a background thread
+
+    Pending notifications with the same summary are coalesced (the latest
+    wins) and sent not often than `min_interval` seconds. `latency` is
+    the time from `notify()` till delivery of the last notification.
+    '''
+    def __init__(self, send=None, min_interval=1):
+        self.send = send or notify_send
+        self.min_interval = min_interval
+        self.latency = None
+        self.sent = 0
+        self.coalesced = 0
+        self._pending = OrderedDict()
+        self._cond = Condition()
+        self._thread = None
+
+    def notify(self, summary, body='', timeout=None, urgent=False):
+        with self._cond:
+            if summary in self._pending:
+                self.coalesced += 1
+            self._pending[summary] = (body, timeout, urgent, time.time())
+            self._cond.notify()
+
+            if not self._thread:
+                self._thread = Thread(target=self.run, daemon=True)
+                self._thread.start()
+
+    def run(self):
+        last = 0
+        while True:
+            time.sleep(max(0, last + self.min_interval - time.time()))
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                summary, (body, timeout, urgent, queued) = (
+                    self._pending.popitem(last=False)
+                )
+
+            try:
+                self.send(summary, body, timeout, urgent)
+            except Exception as e:
+                print('Notification is failed: %r' % e, file=sys.stderr)
+            last = time.time()
+            self.latency = last - queued
+            self.sent += 1
+
+
+def notify_send(summary, body, timeout=None, urgent=False):
+    import subprocess as sp
+
+    cmd = ['notify-send']
+    if timeout:
+        cmd += ['-t', str(int(timeout * 1000))]
+    if urgent:
+        cmd += ['-u', 'critical']
+    sp.call(cmd + ['--', summary, body])
+
+
+def get_libnotify():
+    '''Native notifications via D-Bus if libnotify bindings are available'''
+    try:
+        import gi
+        gi.require_version('Notify', '0.7')
+        from gi.repository import Notify
+    except (ImportError, ValueError):
+        return None
+
+    if not Notify.init('tider'):
+        return None
+
+    def send(summary, body, timeout=None, urgent=False):
+        n = Notify.Notification.new(summary, body, None)
+        if timeout:
+            n.set_timeout(int(timeout * 1000))
+        if urgent:
+            n.set_urgency(Notify.Urgency.CRITICAL)
+        n.show()
+    return send
+
+
+def get_idle():
+    '''Function returning seconds since the last user input'''
+    return get_x11_idle() or get_logind_idle()
+
+
+def get_x11_idle():
+    '''Idle time via X11 screen saver extension (libXss)'''
+    import ctypes
+    import ctypes.util
+
+    class Info(ctypes.Structure):
+        _fields_ = [
+            ('window', ctypes.c_ulong),
+            ('state', ctypes.c_int),
+            ('kind', ctypes.c_int),
+            ('til_or_since', ctypes.c_ulong),
+            ('idle', ctypes.c_ulong),
+            ('event_mask', ctypes.c_ulong),
+        ]
+
+    libs = [ctypes.util.find_library(i) for i in ('X11', 'Xss')]
+    if not all(libs) or not os.environ.get('DISPLAY'):
+        return None
+
+    x11, xss = [ctypes.cdll.LoadLibrary(i) for i in libs]
+    x11.XOpenDisplay.restype = ctypes.c_void_p
+    x11.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    x11.XDefaultRootWindow.restype = ctypes.c_ulong
+    x11.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+    xss.XScreenSaverAllocInfo.restype = ctypes.POINTER(Info)
+    xss.XScreenSaverQueryInfo.argtypes = [
+        ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(Info)
+    ]
+
+    display = x11.XOpenDisplay(None)
+    if not display:
+        return None
+
+    root = x11.XDefaultRootWindow(display)
+    info = xss.XScreenSaverAllocInfo()
+
+    def idle():
+        if not xss.XScreenSaverQueryInfo(display, root, info):
+            return None
+        return info.contents.idle / 1000
+    return idle
+
+
+def get_logind_idle():
+    '''Idle time via `IdleSinceHint` of logind session'''
+    session = os.environ.get('XDG_SESSION_ID')
+    if not session:
+        return None
+
+    def idle():
+        import subprocess as sp
+
+        cmd = [
+            'loginctl', 'show-session', session,
+            '-p', 'IdleHint', '-p', 'IdleSinceHint'
+        ]
+        try:
+            out = sp.check_output(cmd, stderr=sp.DEVNULL)
+        except (OSError, sp.CalledProcessError):
+            return None
+
+        props = dict(i.split('=', 1) for i in out.decode().split())
+        if props.get('IdleHint') != 'yes':
+            return 0
+        return time.time() - int(props['IdleSinceHint']) / 1e6
+    return idle
+
+
+def get_config(conf_dir=None, base=None):
+    '''Config from "config.py" over defaults, ValueError if it is wrong
+
+    `db` and `perf` of `base` config are reused, if it is passed.
+    '''
     conf_dirs = [
         os.path.join(os.path.dirname(__file__), 'var'),
         os.path.join(os.path.expanduser('~'), '.config', 'tider')
     ]
-    conf_dir = [p for p in conf_dirs if os.path.exists(p)]
-    if conf_dir:
-        conf_dir = conf_dir[0]
-    else:
-        conf_dir = conf_dirs[-1]
-        os.mkdir(conf_dir)
+    if not conf_dir:
+        conf_dir = [p for p in conf_dirs if os.path.exists(p)]
+        if conf_dir:
+            conf_dir = conf_dir[0]
+        else:
+            conf_dir = conf_dirs[-1]
+            os.makedirs(conf_dir)
 
-    conf_path = os.path.join(conf_dir, 'config.py')
+    default, custom = compile_config(conf_dir)
     conf = {}
-    exec(DEFAULT_CONFIG, None, conf)
-    if os.path.exists(conf_path):
-        with open(conf_path, 'rb') as f:
-            source = f.read()
-        exec(source, None, conf)
+    exec(default, None, conf)
+    defaults = dict(conf)
+    if custom:
+        exec(custom, None, conf)
+    check_config(conf, defaults)
 
-    sid = '='.join([conf_dir, os.environ.get('XDG_SESSION_ID')])
+    sid = '='.join([conf_dir, os.environ.get('XDG_SESSION_ID', '')])
     sid = hashlib.md5(sid.encode()).hexdigest()
     conf['socket'] = '/tmp/perevod-%s' % sid
     conf['conf_dir'] = conf_dir
     conf['db_path'] = os.path.join(conf_dir, 'log.db')
-    conf['db'] = lambda: connect_db(conf['db_path'])
+    if base:
+        conf['perf'], conf['db'] = base.perf, base.db
+    else:
+        conf['perf'] = Perf()
+        conf['db'] = Db(conf['db_path'], conf['perf'])
     return namedtuple('Conf', conf.keys())(**conf)
 
 
-def connect_db(db_path):
-    db = sqlite3.connect(db_path)
-    if hasattr(connect_db, 'checked'):
-        return db, db.cursor()
+def compile_config(conf_dir):
+    '''Code of default config and of "config.py" (None if it is absent)
 
-    cur = db.cursor()
-    cur.execute(
-        'SELECT name FROM sqlite_master WHERE type="table" AND name="log"'
+    The code is cached in "config.cache", it is compiled again if
+    "config.py", the default config or Python version is changed.
+    '''
+    import marshal
+
+    conf_path = os.path.join(conf_dir, 'config.py')
+    cache_path = os.path.join(conf_dir, 'config.cache')
+    key = (
+        sys.implementation.cache_tag,
+        hashlib.md5(DEFAULT_CONFIG.encode()).hexdigest(),
+        get_stamp(conf_path)
     )
-    if not cur.fetchone():
-        cur.execute(
-            '''
-            CREATE TABLE `log`(
-                `id` INTEGER PRIMARY KEY,
-                `target` TEXT NOT NULL,
-                `start` INTEGER NOT NULL,
-                `end` INTEGER,
-                `work` INTEGER,
-                `break` INTEGER,
-                UNIQUE (target, start)
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_key, code = marshal.load(f)
+        if cached_key == key:
+            return code
+    except (OSError, EOFError, ValueError, TypeError):
+        pass
+
+    code = [compile(DEFAULT_CONFIG, '<default config>', 'exec'), None]
+    if key[-1]:
+        with open(conf_path, 'rb') as f:
+            code[1] = compile(f.read(), conf_path, 'exec')
+    try:
+        with open_via_tmpfile(cache_path, mode='wb') as f:
+            marshal.dump((key, code), f)
+    except OSError:
+        pass
+    return code
+
+
+# Used as divisors and as minimal periods of ticks
+POSITIVE_SETTINGS = ('update_period', 'text_precision', 'offline_timeout')
+
+
+def check_config(conf, defaults):
+    '''Values must be of the same kind as defaults
+
+    Numbers can't be negative (`POSITIVE_SETTINGS` can't be zero too) and
+    strings can't be empty, `None` by default means any value.
+    '''
+    for name, default in defaults.items():
+        value = conf[name]
+        if default is None or value is default:
+            continue
+        elif callable(default):
+            valid = callable(value)
+        elif isinstance(default, bool):
+            valid = isinstance(value, bool)
+        elif isinstance(default, (int, float)):
+            valid = (
+                isinstance(value, (int, float)) and
+                not isinstance(value, bool) and value >= 0 and
+                (value > 0 or name not in POSITIVE_SETTINGS)
             )
-            '''
-        )
-        cur.execute(
-            '''
-            CREATE VIEW `log_pretty` AS
-            SELECT
-                id, target, work / 60 AS work_m, break / 60 AS break_m,
-                start, datetime(start, 'unixepoch', 'localtime') AS start_str,
-                end, datetime(end, 'unixepoch', 'localtime') AS end_str
-            FROM `log` WHERE work_m > 0 OR break_m > 0
-            '''
+        elif isinstance(default, str):
+            valid = isinstance(value, str) and value != ''
+        else:
+            valid = isinstance(value, type(default))
+
+        if not valid:
+            raise ValueError('Wrong value of "%s": %r' % (name, value))
+
+
+class Perf:
+    '''Timings of hot paths, the last `size` of them are kept in a ring
+
+    `with perf(name):` records `(name, time, duration, queries, steps)`,
+    where `queries` is a number of SQL statements and `steps` is thousands
+    of SQLite VM instructions run inside. `size=0` disables recording,
+    it is disabled by default and enabled only by running instance.
+    '''
+    buckets = (1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1, float('inf'))
+    labels = ('10us', '100us', '1ms', '10ms', '100ms', '1s', 'inf')
+
+    def __init__(self, size=0):
+        self.calls = {}
+        self.queries = 0
+        self.steps = 0
+        self.enable(size)
+
+    def enable(self, size):
+        '''Connections opened before are not watched'''
+        self.size = size
+        self.ring = deque(maxlen=size or 1)
+
+    @contextmanager
+    def __call__(self, name):
+        mark = self.start()
+        try:
+            yield
+        finally:
+            self.stop(name, mark)
+
+    def start(self):
+        return self.size and (time.perf_counter(), self.queries, self.steps)
+
+    def stop(self, name, mark):
+        if not mark:
+            return
+
+        start, queries, steps = mark
+        self.ring.append((
+            name, time.time(), time.perf_counter() - start,
+            self.queries - queries, self.steps - steps
+        ))
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def watch(self, db):
+        if not self.size:
+            return
+
+        def on_query(statement):
+            self.queries += 1
+
+        def on_steps():
+            self.steps += 1
+            return 0
+
+        db.set_trace_callback(on_query)
+        db.set_progress_handler(on_steps, 1000)
+
+    def summary(self):
+        '''Statistics of recorded timings by name, durations in ms'''
+        records = {}
+        for name, started, duration, queries, steps in self.ring:
+            records.setdefault(name, []).append((duration, queries, steps))
+
+        ms = lambda v: round(v * 1000, 3)
+        result = {}
+        for name, rows in sorted(records.items()):
+            durations = sorted(r[0] for r in rows)
+            count = len(rows)
+            hist = [0] * len(self.buckets)
+            for d in durations:
+                hist[bisect_left(self.buckets, d)] += 1
+            result[name] = {
+                'calls': self.calls[name],
+                'count': count,
+                'mean': ms(sum(durations) / count),
+                'p50': ms(durations[count // 2]),
+                'p99': ms(durations[min(count - 1, int(count * 0.99))]),
+                'max': ms(durations[-1]),
+                'queries': round(sum(r[1] for r in rows) / count, 2),
+                'steps': round(sum(r[2] for r in rows) / count, 2),
+                'hist': {
+                    label: n for label, n in zip(self.labels, hist) if n
+                },
+            }
+        return result
+
+
+class Db:
+    '''Long-lived SQLite connections, one per thread
+
+    `conf.db()` returns `(connection, cursor)` for the current thread,
+    `close()` closes all of them, `count` is a number of open connections.
+    '''
+    def __init__(self, path, perf=None):
+        self.path = path
+        self.perf = perf
+        self._local = local()
+        self._lock = Lock()
+        self._connections = []
+        self._ready = False
+
+    def __call__(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = self.connect()
+        return db, db.cursor()
+
+    @property
+    def count(self):
+        return len(self._connections)
+
+    def connect(self):
+        import sqlite3
+
+        # Connections are closed from the main thread by `close()`
+        db = sqlite3.connect(
+            self.path, timeout=10, check_same_thread=False,
+            cached_statements=256
         )
-        db.commit()
-    connect_db.checked = True
-    return db, db.cursor()
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('PRAGMA synchronous = NORMAL')
+        db.execute('PRAGMA temp_store = MEMORY')
+        if self.perf:
+            self.perf.watch(db)
+        with self._lock:
+            if not self._ready:
+                init_db(db)
+                self._ready = True
+            self._connections.append(db)
+        self._local.db = db
+        return db
+
+    def close(self):
+        with self._lock:
+            for db in self._connections:
+                db.close()
+            self._connections = []
+            self._local = local()
+
+
+# Schema changes of "log.db", the index + 1 is stored as `user_version`
+MIGRATIONS = [
+    '''
+    CREATE TABLE IF NOT EXISTS `log`(
+        `id` INTEGER PRIMARY KEY,
+        `target` TEXT NOT NULL,
+        `start` INTEGER NOT NULL,
+        `end` INTEGER,
+        `work` INTEGER,
+        `break` INTEGER,
+        UNIQUE (target, start)
+    );
+    CREATE VIEW IF NOT EXISTS `log_pretty` AS
+    SELECT
+        id, target, work / 60 AS work_m, break / 60 AS break_m,
+        start, datetime(start, 'unixepoch', 'localtime') AS start_str,
+        end, datetime(end, 'unixepoch', 'localtime') AS end_str
+    FROM `log` WHERE work_m > 0 OR break_m > 0;
+    ''',
+    # Time range queries, it also covers the report query
+    '''
+    CREATE INDEX IF NOT EXISTS `log_start` ON `log` (start, target, work);
+    ''',
+    # Daily totals for reports, maintained by triggers
+    '''
+    CREATE TABLE `daily_totals`(
+        `day` TEXT NOT NULL,
+        `target` TEXT NOT NULL,
+        `work` INTEGER NOT NULL DEFAULT 0,
+        `break` INTEGER NOT NULL DEFAULT 0,
+        `entries` INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, target)
+    ) WITHOUT ROWID;
+    INSERT INTO `daily_totals` (day, target, work, break, entries)
+    SELECT
+        date(start, 'unixepoch', 'localtime'), target,
+        SUM(IFNULL(work, 0)), SUM(IFNULL(break, 0)), COUNT(*)
+    FROM `log` GROUP BY 1, 2;
+
+    CREATE TRIGGER `daily_totals_insert` AFTER INSERT ON `log`
+    BEGIN
+        INSERT OR IGNORE INTO `daily_totals` (day, target)
+        VALUES (date(NEW.start, 'unixepoch', 'localtime'), NEW.target);
+        UPDATE `daily_totals` SET
+            work = work + IFNULL(NEW.work, 0),
+            break = break + IFNULL(NEW.break, 0),
+            entries = entries + 1
+        WHERE
+            day = date(NEW.start, 'unixepoch', 'localtime')
+            AND target = NEW.target;
+    END;
+    CREATE TRIGGER `daily_totals_delete` AFTER DELETE ON `log`
+    BEGIN
+        UPDATE `daily_totals` SET
+            work = work - IFNULL(OLD.work, 0),
+            break = break - IFNULL(OLD.break, 0),
+            entries = entries - 1
+        WHERE
+            day = date(OLD.start, 'unixepoch', 'localtime')
+            AND target = OLD.target;
+        DELETE FROM `daily_totals`
+        WHERE
+            day = date(OLD.start, 'unixepoch', 'localtime')
+            AND target = OLD.target AND entries <= 0;
+    END;
+    CREATE TRIGGER `daily_totals_update`
+    AFTER UPDATE OF target, start, work, break ON `log`
+    BEGIN
+        UPDATE `daily_totals` SET
+            work = work - IFNULL(OLD.work, 0),
+            break = break - IFNULL(OLD.break, 0),
+            entries = entries - 1
+        WHERE
+            day = date(OLD.start, 'unixepoch', 'localtime')
+            AND target = OLD.target;
+        DELETE FROM `daily_totals`
+        WHERE
+            day = date(OLD.start, 'unixepoch', 'localtime')
+            AND target = OLD.target AND entries <= 0;
+        INSERT OR IGNORE INTO `daily_totals` (day, target)
+        VALUES (date(NEW.start, 'unixepoch', 'localtime'), NEW.target);
+        UPDATE `daily_totals` SET
+            work = work + IFNULL(NEW.work, 0),
+            break = break + IFNULL(NEW.break, 0),
+            entries = entries + 1
+        WHERE
+            day = date(NEW.start, 'unixepoch', 'localtime')
+            AND target = NEW.target;
+    END;
+    ''',
+    # Targets for completion, maintained by triggers
+    '''
+    CREATE TABLE `targets`(
+        `name` TEXT PRIMARY KEY,
+        `last_used` INTEGER NOT NULL,
+        `use_count` INTEGER NOT NULL DEFAULT 0,
+        `total_work` INTEGER NOT NULL DEFAULT 0
+    );
+    INSERT INTO `targets` (name, last_used, use_count, total_work)
+    SELECT target, MAX(start), COUNT(*), SUM(IFNULL(work, 0))
+    FROM `log` GROUP BY target;
+
+    CREATE TRIGGER `targets_insert` AFTER INSERT ON `log`
+    BEGIN
+        INSERT OR IGNORE INTO `targets` (name, last_used)
+        VALUES (NEW.target, NEW.start);
+        UPDATE `targets` SET
+            last_used = MAX(last_used, NEW.start),
+            use_count = use_count + 1,
+            total_work = total_work + IFNULL(NEW.work, 0)
+        WHERE name = NEW.target;
+    END;
+    CREATE TRIGGER `targets_delete` AFTER DELETE ON `log`
+    BEGIN
+        UPDATE `targets` SET
+            last_used = IFNULL(
+                (SELECT MAX(start) FROM `log` WHERE target = OLD.target),
+                last_used
+            ),
+            use_count = use_count - 1,
+            total_work = total_work - IFNULL(OLD.work, 0)
+        WHERE name = OLD.target;
+        DELETE FROM `targets` WHERE name = OLD.target AND use_count <= 0;
+    END;
+    CREATE TRIGGER `targets_update`
+    AFTER UPDATE OF target, start, work ON `log`
+    BEGIN
+        UPDATE `targets` SET
+            last_used = IFNULL(
+                (SELECT MAX(start) FROM `log` WHERE target = OLD.target),
+                last_used
+            ),
+            use_count = use_count - 1,
+            total_work = total_work - IFNULL(OLD.work, 0)
+        WHERE name = OLD.target;
+        DELETE FROM `targets` WHERE name = OLD.target AND use_count <= 0;
+        INSERT OR IGNORE INTO `targets` (name, last_used)
+        VALUES (NEW.target, NEW.start);
+        UPDATE `targets` SET
+            last_used = MAX(last_used, NEW.start),
+            use_count = use_count + 1,
+            total_work = total_work + IFNULL(NEW.work, 0)
+        WHERE name = NEW.target;
+    END;
+    ''',
+]
+
+
+def init_db(db):
+    '''Apply missing migrations, each one in its own write transaction
+
+    The version is read again after the lock is taken, so other process
+    starting at the same time doesn't apply the same migration twice.
+    '''
+    db.commit()
+    while True:
+        with db:
+            db.execute('BEGIN IMMEDIATE')
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+            if version >= len(MIGRATIONS):
+                break
+            for sql in split_sql(MIGRATIONS[version]):
+                db.execute(sql)
+            db.execute('PRAGMA user_version = %d' % (version + 1))
+
+
+def split_sql(script):
+    '''Statements of `script`, `executescript` can't run in a transaction'''
+    import sqlite3
+
+    sql = ''
+    for line in script.splitlines(True):
+        sql += line
+        if sqlite3.complete_statement(sql):
+            yield sql
+            sql = ''
+    if sql.strip():
+        yield sql
 
 
 @contextmanager
-def open_via_tmpfile(filename, suffix='.tmp', mode=None):
-    '''Manipulate the tmp file and then quickly rename to `filename`'''
+def open_via_tmpfile(filename, suffix='.tmp', mode=None, sync=False):
+    '''Manipulate the tmp file and then quickly rename to `filename`
+
+    With `sync` the data and the rename are flushed to disk, so after a crash
+    `filename` contains either old or new content.
+    '''
     tmp = filename + suffix
     with open(tmp, mode) as f:
         yield f
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
     os.rename(tmp, filename)
+    if sync:
+        fd = os.open(os.path.dirname(filename) or '.', os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+def get_stamp(path):
+    '''Identity of the file content, used to notice external changes'''
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns, st.st_size
 
 
 def split_seconds(v):
-    d = {'h': int(v / 60 / 60), 'm': int(v / 60 % 60), 's': int(v % 60)}
-    return namedtuple('Duration', d.keys())(**d)
+    return Duration(int(v / 60 / 60), int(v / 60 % 60), int(v % 60))
+
 
+def str_seconds(duration, precision=1):
+    '''Like "1h 2m 3s", rounded down to `precision` in seconds
 
-def str_seconds(duration):
-    time = split_seconds(duration)
+    Minutes and above are shown without seconds.
+    '''
+    time = split_seconds(duration - duration % precision)
     result = '{}h '.format(time.h) if time.h else ''
+    if precision >= 60:
+        return result + '{}m'.format(time.m)
     result += '{}m '.format(time.m) if time.h or time.m else ''
     result += '{}s'.format(time.s)
     return result
@@ -625,7 +1755,7 @@ def str_time(v):
     return time.strftime('%H:%M', time.localtime(v))
 
 
-def get_report(conf, interval=None, like=None, label=None, quiet=True):
+def get_report(conf, interval=None, like=None, label=None, tree=None):
     if not interval:
         interval = [time.strftime(SQL_DATE)]
 
@@ -636,64 +1766,728 @@ def get_report(conf, interval=None, like=None, label=None, quiet=True):
 
     db, cursor = conf.db()
     cursor.execute(
-        'SELECT target, SUM(work) FROM log'
-        '   WHERE date(start, "unixepoch", "localtime") BETWEEN ? AND ?' +
-        ('  AND target like ?' if like else '') +
+        'SELECT target, SUM(work) FROM daily_totals'
+        '   WHERE day BETWEEN ? AND ? AND target LIKE ?'
         '   GROUP BY target'
         '   ORDER BY 2 DESC',
-        interval + [like] if like else []
+        interval + [like]
+    )
+    return make_report(cursor.fetchall(), interval, label, tree)
+
+
+def get_report_buckets(conf, interval, granularity, like=None):
+    '''Split `interval` to daily, weekly or monthly reports by one query
+
+    Returns a list of `(interval, rows)`.
+    '''
+    import datetime as dt
+
+    day = dt.timedelta(days=1)
+    begin, end = [dt.datetime.strptime(i, SQL_DATE).date() for i in interval]
+
+    buckets = []
+    while begin <= end:
+        if granularity == 'daily':
+            last = begin
+        elif granularity == 'weekly':
+            last = begin + day * (6 - begin.weekday())
+        elif granularity == 'monthly':
+            last = (begin.replace(day=28) + day * 4).replace(day=1) - day
+        else:
+            raise ValueError('Wrong granularity')
+        last = min(last, end)
+        interval_ = [begin.strftime(SQL_DATE), last.strftime(SQL_DATE)]
+        buckets.append((interval_, {}))
+        begin = last + day
+
+    db, cursor = conf.db()
+    cursor.execute(
+        'SELECT day, target, work FROM daily_totals'
+        '   WHERE day BETWEEN ? AND ? AND target LIKE ?'
+        '   ORDER BY day',
+        interval + [like or '%%']
     )
-    rows = cursor.fetchall()
+    buckets_ = iter(buckets)
+    interval_, totals = next(buckets_)
+    for day_, target, work_time in cursor:
+        while day_ > interval_[1]:
+            interval_, totals = next(buckets_)
+        totals[target] = totals.get(target, 0) + work_time
+
+    return [
+        (interval_, sorted(totals.items(), key=lambda r: -r[1]))
+        for interval_, totals in buckets
+    ]
+
+
+def get_reports(conf, interval=None, granularity=None, like=None, tree=None):
+    '''Report for each bucket of `interval` and the total one'''
+    if not granularity or len(interval or []) != 2:
+        return [get_report(conf, interval, like, tree=tree)]
+
+    buckets = get_report_buckets(conf, interval, granularity, like)
+    reports, total = [], {}
+    for interval_, rows in buckets:
+        reports.append(make_report(rows, interval_, tree=tree))
+        for target, work_time in rows:
+            total[target] = total.get(target, 0) + work_time
+    reports.append(make_report(list(total.items()), interval, tree=tree))
+    return reports
+
 
+def make_report(rows, interval, label=None, tree=None):
+    '''Report with `(target, work, depth)` rows from `(target, work)`'''
+    if len(interval) == 1:
+        interval = interval * 2
+
+    total = sum(r[1] for r in rows)
+    if tree:
+        rows = get_tree(rows, tree)
+    else:
+        rows = [(t, w, 0) for t, w in sorted(rows, key=lambda r: -r[1])]
+    return Report(interval=list(interval), label=label, rows=rows, total=total)
+
+
+def get_tree(rows, separators='@'):
+    '''Roll up work of targets by their parts split before `separators`
+
+    Returns `(prefix, work, depth)` in tree order, siblings are sorted by
+    total work, a node without own work and with one child is joined to it.
+    '''
+    part = re.compile('[^{0}]+|[{0}][^{0}]*'.format(re.escape(separators)))
+    root = {}
+    for target, work_time in rows:
+        children = root
+        for name in part.findall(target) or [target]:
+            node = children.setdefault(name, [0, 0, {}])
+            node[0] += work_time
+            children = node[2]
+        node[1] += work_time
+
+    def walk(children, depth, prefix):
+        children = sorted(children.items(), key=lambda i: -i[1][0])
+        for name, (total, own, children) in children:
+            while not own and len(children) == 1:
+                (child, (total, own, children)), = children.items()
+                name += child
+            yield prefix + name, total, depth
+            yield from walk(children, depth + 1, prefix + name)
+    return list(walk(root, 0, ''))
+
+
+def render_report(report, quiet=True, markup=False):
+    '''Text table of one report, Pango markup is used if `markup`'''
+    if markup:
+        import html
+
+        b, tt = '<b>{}</b>', '<tt>{}</tt>'
+        escape = lambda v: html.escape(v, quote=False)
+    else:
+        b, tt, escape = '{}', '{}', lambda v: v
+
+    interval, label, rows = report.interval, report.label, report.rows
     if not rows and quiet:
         result = []
     elif label:
-        result = ['<b>Statistics {}</b>'.format(label)]
+        result = [b.format('Statistics {}'.format(label))]
     elif interval[0] == interval[1]:
-        result = ['<b>Statistics for {}</b>'.format(interval[0])]
+        result = [b.format('Statistics for {}'.format(interval[0]))]
     else:
-        result = ['<b>Statistics from {} to {}</b>'.format(*interval)]
+        result = [b.format('Statistics from {} to {}'.format(*interval))]
 
     if not rows:
         result += [] if quiet else ['  No activities']
     elif len(rows) == 1:
         row = rows[0]
-        result += ['  {}: {}'.format(row[0], str_seconds(row[1]))]
+        result += ['  {}: {}'.format(escape(row[0]), str_seconds(row[1]))]
     elif len(rows) > 1:
-        total = sum(v[1] for v in rows)
-        rows += [('total', total)]
+        # Tree rows show only their own part of the prefix
+        names, parents = [], {}
+        for target, work_time, depth in rows:
+            parents[depth] = target
+            name = target[len(parents[depth - 1]):] if depth else target
+            names.append(('  ' * depth + name, work_time))
+        names += [('total', report.total)]
 
         header = ('target', 'work')
-        width = max([len(header[0])] + [len(r[0]) for r in rows])
+        width = max([len(header[0])] + [len(r[0]) for r in names])
 
         pattern_ = '|{:<%s}|{:>11}|' % width
         line = lambda *a: pattern_.format(*a)
         sep = line('-' * width, *(['-' * 11] * 2))
 
         details = [line(*header), sep]
-        for target, work_time in rows:
+        for name, work_time in names:
             details += [
-                line(target, str_seconds(work_time))
+                line(name, str_seconds(work_time))
             ]
         details.insert(-1, sep)
-        result += ['<tt>{}</tt>'.format('\n'.join(details))]
+        result += [tt.format(escape('\n'.join(details)))]
 
     result = '\n'.join(result)
     return result
 
 
-def send_action(address, action):
+def render_text(reports, quiet=True, markup=False):
+    result = [render_report(r, quiet, markup) for r in reports]
+    return '\n\n'.join(r for r in result if r)
+
+
+def render_json(reports, quiet=True):
+    return json.dumps([
+        {
+            'from': r.interval[0],
+            'to': r.interval[1],
+            'label': r.label,
+            'total': round(r.total),
+            'rows': [
+                {'target': target, 'work': round(work_time), 'depth': depth}
+                for target, work_time, depth in r.rows
+            ]
+        }
+        for r in reports if r.rows or not quiet
+    ], ensure_ascii=False, indent=2)
+
+
+def render_csv(reports, quiet=True):
+    import csv
+
+    f = io.StringIO()
+    writer = csv.writer(f, lineterminator='\n')
+    writer.writerow(('from', 'to', 'label', 'target', 'work', 'depth'))
+    for r in reports:
+        for target, work_time, depth in r.rows:
+            writer.writerow(
+                r.interval + [r.label or '', target, round(work_time), depth]
+            )
+    return f.getvalue().rstrip('\n')
+
+
+REPORT_FORMATS = {
+    'text': render_text,
+    'pango': lambda reports, quiet: render_text(reports, quiet, markup=True),
+    'json': render_json,
+    'csv': render_csv,
+}
+
+
+@contextmanager
+def open_stream(path, mode):
+    '''Binary file or stdin/stdout if `path` is "-"'''
+    if path != '-':
+        with open(path, mode) as f:
+            yield f
+    elif 'r' in mode:
+        yield sys.stdin.buffer
+    else:
+        yield sys.stdout.buffer
+        sys.stdout.buffer.flush()
+
+
+def get_log(conf):
+    db, cursor = conf.db()
+    cursor.execute(
+        'SELECT %s FROM log ORDER BY start' % ', '.join(LOG_FIELDS)
+    )
+    yield from cursor
+
+
+def dump_csv(rows, f):
+    import csv
+
+    f = io.TextIOWrapper(f, encoding='utf-8', newline='')
+    writer = csv.writer(f)
+    writer.writerow(LOG_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        yield row
+    f.detach()
+
+
+def load_csv(f):
+    import csv
+
+    f = io.TextIOWrapper(f, encoding='utf-8', newline='')
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header != list(LOG_FIELDS):
+        raise SystemExit('Wrong CSV header: %s' % header)
+
+    num = lambda v, type_: type_(float(v)) if v else None
+    for row in reader:
+        try:
+            target, start, end, work, break_ = row
+            row = (
+                target, num(start, float), num(end, float),
+                num(work, int), num(break_, int)
+            )
+            if not target or row[1] is None:
+                raise ValueError
+        except ValueError:
+            raise SystemExit(
+                'Wrong CSV row on line %s: %s' % (reader.line_num, row)
+            )
+        yield row
+
+
+def dump_jsonl(rows, f):
+    for row in rows:
+        f.write(json.dumps(dict(zip(LOG_FIELDS, row))).encode() + b'\n')
+        yield row
+
+
+def load_jsonl(f):
+    for line_num, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line.decode())
+            valid = (
+                isinstance(row, dict) and
+                isinstance(row.get('target'), str) and row['target'] and
+                row.get('start') is not None
+            )
+        except ValueError:
+            valid = False
+        if not valid:
+            raise SystemExit('Wrong JSON row on line %s' % line_num)
+        yield tuple(row.get(i) for i in LOG_FIELDS)
+
+
+# Binary format: header, then per row: start, end, work, break as doubles
+# (NaN is NULL), length of target and target itself in UTF-8
+BIN_HEADER = b'TIDER-LOG1\n'
+BIN_ROW = '<4dH'
+
+
+def dump_bin(rows, f):
+    import struct
+
+    pack = struct.Struct(BIN_ROW).pack
+    f.write(BIN_HEADER)
+    for row in rows:
+        target = row[0].encode()
+        values = [float('nan') if v is None else v for v in row[1:]]
+        f.write(pack(*values, len(target)) + target)
+        yield row
+
+
+def load_bin(f):
+    import struct
+
+    if f.read(len(BIN_HEADER)) != BIN_HEADER:
+        raise SystemExit('Wrong binary header')
+
+    row = struct.Struct(BIN_ROW)
+    offset = len(BIN_HEADER)
+    while True:
+        data = f.read(row.size)
+        if not data:
+            break
+        try:
+            *values, size = row.unpack(data)
+            target = f.read(size)
+            target = struct.unpack('%ss' % size, target)[0].decode()
+        except (struct.error, UnicodeDecodeError):
+            raise SystemExit('Wrong binary row at offset %s' % offset)
+        values = [None if v != v else v for v in values]
+        start, end, work, break_ = values
+        if not target or start is None:
+            raise SystemExit('Wrong binary row at offset %s' % offset)
+        offset += len(data) + size
+        yield (
+            target, start, end,
+            None if work is None else int(work),
+            None if break_ is None else int(break_),
+        )
+
+
+LOG_FORMATS = {
+    'csv': (dump_csv, load_csv),
+    'jsonl': (dump_jsonl, load_jsonl),
+    'bin': (dump_bin, load_bin),
+}
+
+
+def export_log(conf, path='-', format='csv'):
+    dump = LOG_FORMATS[format][0]
+    start, count = time.time(), 0
+    try:
+        with open_stream(path, 'wb') as f:
+            for row in dump(get_log(conf), f):
+                count += 1
+    except BrokenPipeError:
+        # The reader has gone (e.g. "tider export | head"), so stdout is
+        # muted to not fail again on flushing at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return
+    print_rate('Exported %s rows' % count, count, start)
+
+
+def import_log(conf, path='-', format='csv', batch=5000):
+    '''Insert rows in one transaction, existing (target, start) are skipped
+
+    Loaders reject rows without target or start, otherwise "OR IGNORE"
+    would drop them silently and count them as existing.
+    '''
+    load = LOG_FORMATS[format][1]
+    start, count, inserted = time.time(), 0, 0
+
+    db, cursor = conf.db()
+    sql = 'INSERT OR IGNORE INTO log (%s) VALUES (?, ?, ?, ?, ?)'
+    sql %= ', '.join(LOG_FIELDS)
+    with open_stream(path, 'rb') as f, db:
+        rows = load(f)
+        while True:
+            chunk = [row for i, row in zip(range(batch), rows)]
+            if not chunk:
+                break
+            cursor.executemany(sql, chunk)
+            count += len(chunk)
+            inserted += cursor.rowcount
+
+    print_rate(
+        'Imported %s of %s rows (%s already exist)'
+        % (inserted, count, count - inserted), count, start
+    )
+
+
+def merge_log(conf, paths):
+    '''Merge logs of other machines into local one, each by own transaction
+
+    Rows with the same `(target, start)` are skipped as duplicates. A row
+    overlapping local rows of the same kind (work or break) is trimmed to
+    its not overlapped parts, so the same time isn't counted twice, parts
+    shorter than `min_duration` are dropped. Rows without overlaps are
+    copied by SQL, only overlapping ones are loaded into Python.
+
+    Databases are attached one by one, SQLite limits attached ones to 10.
+    '''
+    import sqlite3
+
+    for path in paths:
+        if not os.path.exists(path):
+            raise SystemExit('No such database: %s' % path)
+
+    db, cursor = conf.db()
+    db.commit()
+    summary = []
+    for path in paths:
+        try:
+            cursor.execute('ATTACH DATABASE ? AS other', [path])
+            try:
+                with db:
+                    summary.append((path,) + merge_db(cursor, conf))
+            finally:
+                cursor.execute('DETACH DATABASE other')
+        except sqlite3.DatabaseError as e:
+            raise SystemExit('Wrong database %s: %s' % (path, e))
+
+    header = (
+        'database', 'rows', 'merged', 'trimmed', 'duplicates', 'overlaps'
+    )
+    if len(summary) > 1:
+        totals = list(zip(*summary))[1:]
+        summary += [('total',) + tuple(sum(i) for i in totals)]
+    width = max(len(str(r[0])) for r in [header] + summary)
+    line = ('{:<%s}' % width + '|{:>10}' * 5).format
+    print('\n'.join(line(*r) for r in [header] + summary))
+
+
+def merge_db(cursor, conf):
+    '''Merge "other" database, returns counts for the summary'''
+    fields = ', '.join(LOG_FIELDS)
+    duplicate = (
+        'SELECT 1 FROM main.log l'
+        '   WHERE l.target = o.target AND l.start = o.start'
+    )
+    # The longest local row limits the index range for overlaps
+    overlap = (
+        'l.start > o.start - :span'
+        '   AND l.start < IFNULL(o.end, o.start)'
+        '   AND IFNULL(l.end, l.start) > o.start'
+        '   AND (IFNULL(l.work, 0) > 0) = (IFNULL(o.work, 0) > 0)'
+    )
+    cursor.execute('SELECT IFNULL(MAX(end - start), 0) FROM main.log')
+    span = cursor.fetchone()[0]
+    cursor.execute('SELECT COUNT(*) FROM other.log')
+    total = cursor.fetchone()[0]
+    cursor.execute(
+        'SELECT COUNT(*) FROM other.log o WHERE EXISTS (%s)' % duplicate
+    )
+    duplicates = cursor.fetchone()[0]
+    cursor.execute(
+        'INSERT INTO main.log (%s) SELECT %s FROM other.log o '
+        'WHERE NOT EXISTS (%s) AND NOT EXISTS ('
+        '   SELECT 1 FROM main.log l WHERE %s'
+        ')' % (fields, fields, duplicate, overlap),
+        {'span': span}
+    )
+    merged = cursor.rowcount
+    cursor.execute('SELECT IFNULL(MAX(end - start), 0) FROM main.log')
+    span = cursor.fetchone()[0]
+
+    # Copied rows are duplicates now, so only overlapping left
+    cursor.execute(
+        'SELECT id, %s FROM other.log o WHERE NOT EXISTS (%s) ORDER BY start'
+        % (fields, duplicate)
+    )
+    overlapped = cursor.fetchall()
+    parts = (
+        'SELECT l.start, IFNULL(l.end, l.start)'
+        '   FROM other.log o, main.log l'
+        '   WHERE o.id = :id AND %s'
+        '   ORDER BY l.start' % overlap
+    )
+    trimmed = 0
+    for row in overlapped:
+        cursor.execute(parts, {'id': row[0], 'span': span})
+        trimmed += merge_parts(
+            cursor, row[1:], cursor.fetchall(), conf.min_duration
+        )
+    overlaps = total - duplicates - merged - trimmed
+    return total, merged, trimmed, duplicates, overlaps
+
+
+def merge_parts(cursor, row, intervals, min_duration):
+    '''Insert parts of `row` out of sorted `intervals`, 1 if any'''
+    target, start, end, work, break_ = row
+    end = start if end is None else end
+
+    parts, begin = [], start
+    for start_, end_ in intervals:
+        if start_ > begin:
+            parts.append((begin, min(start_, end)))
+        begin = max(begin, end_)
+    if begin < end:
+        parts.append((begin, end))
+
+    share = lambda v, a, b: (
+        None if v is None else int(v * (b - a) / (end - start))
+    )
+    parts = [
+        (target, a, b, share(work, a, b), share(break_, a, b))
+        for a, b in parts if b - a >= min_duration
+    ]
+    cursor.executemany(
+        'INSERT OR IGNORE INTO log (%s) VALUES (?, ?, ?, ?, ?)'
+        % ', '.join(LOG_FIELDS), parts
+    )
+    return 1 if parts else 0
+
+
+def print_rate(message, count, start):
+    duration = time.time() - start
+    rate = count / duration if duration else count
+    print(
+        '%s in %.2fs, %d rows/s' % (message, duration, rate),
+        file=sys.stderr
+    )
+
+
+class Server:
+    '''Control socket of running instance
+
+    A request is a line "<action> [argument]", a reply is a JSON line:
+    `{"ok": true, "result": ...}` or `{"ok": false, "error": "..."}`.
+    Clients are served concurrently, every action is run by `dispatch`.
+
+    After "subscribe" line the client receives a reply with the current
+    status and then one on every change (a slow client gets only the
+    latest one), till it is disconnected.
+
+    Old clients send only a bare action without newline in the first
+    packet and receive "OK".
+    '''
+    def __init__(self, address, handler, dispatch):
+        self.address = address
+        self.handler = handler
+        self.dispatch = dispatch
+        self.status = None
+        self.loop = None
+        self.subscribers = set()
+
+    def publish(self, status):
+        '''Can be called from any thread'''
+        self.status = status
+        if self.loop:
+            self.loop.call_soon_threadsafe(self.notify)
+
+    def notify(self):
+        for event in self.subscribers:
+            event.set()
+
+    async def subscribe(self, writer):
+        import asyncio
+
+        event = asyncio.Event()
+        self.subscribers.add(event)
+        try:
+            while True:
+                if self.status is not None:
+                    reply = {'ok': True, 'result': self.status}
+                    writer.write(json.dumps(reply).encode() + b'\n')
+                    await writer.drain()
+                await event.wait()
+                event.clear()
+        finally:
+            self.subscribers.discard(event)
+
+    def run(self):
+        # asyncio is imported here, because it slows down CLI start
+        import asyncio
+
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        import asyncio
+
+        self.loop = asyncio.get_running_loop()
+        server = await asyncio.start_unix_server(self.handle, self.address)
+        async with server:
+            await server.serve_forever()
+
+    def get_action(self, name):
+        return getattr(self.handler, 'pub_' + name, None)
+
+    async def call(self, line):
+        name, *args = line.split(None, 1)
+        action = self.get_action(name)
+        if not action:
+            return {'ok': False, 'error': 'Wrong action: %s' % name}
+
+        try:
+            result = await self.dispatch(action, *args)
+        except Exception as e:
+            return {'ok': False, 'error': repr(e)}
+        return {'ok': True, 'result': result}
+
+    def get_bare_action(self, buf):
+        try:
+            name = buf.decode()
+        except UnicodeDecodeError:
+            return None
+        return name if self.get_action(name) else None
+
+    async def handle(self, reader, writer):
+        import asyncio
+
+        buf = b''
+        try:
+            data = await reader.read(1024)
+            name = self.get_bare_action(data)
+            if name:
+                # Old client sends a bare action without newline and waits
+                # for the answer, a new one would continue the line
+                try:
+                    more = await asyncio.wait_for(reader.read(1024), 0.05)
+                except asyncio.TimeoutError:
+                    more = b''
+                if not more:
+                    reply = await self.call(name)
+                    reply = OK if reply['ok'] else reply['error']
+                    writer.write(reply.encode())
+                    await writer.drain()
+                    return
+                data += more
+
+            while data:
+                buf += data
+                while b'\n' in buf:
+                    line, buf = buf.split(b'\n', 1)
+                    try:
+                        line = line.decode().strip()
+                    except UnicodeDecodeError:
+                        reply = {'ok': False, 'error': 'Wrong encoding'}
+                    else:
+                        if not line:
+                            continue
+                        elif line == 'subscribe':
+                            return await self.subscribe(writer)
+                        reply = await self.call(line)
+                    writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+                data = await reader.read(1024)
+        except ConnectionError:
+            pass
+        except asyncio.CancelledError:
+            # The loop is stopped, the client is just disconnected
+            pass
+        finally:
+            writer.close()
+
+
+def send_action(address, action, arg=None):
     s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     try:
         s.connect(address)
     except socket.error:
         return 'Error. No answer'
-    s.send(action.encode())
-    data = s.recv(1024)
-    s.close()
-    if data:
-        return data.decode()
-    return 'Error. Empty answer'
+
+    with s:
+        line = action if arg is None else '%s %s' % (action, arg)
+        s.sendall(line.encode() + b'\n')
+        data = s.makefile('rb').readline()
+    if not data:
+        return 'Error. Empty answer'
+
+    reply = json.loads(data.decode())
+    if not reply['ok']:
+        return 'Error. %s' % reply['error']
+    return OK if reply['result'] is None else reply['result']
+
+
+def print_result(result):
+    if not isinstance(result, str):
+        result = json.dumps(result, indent=2, ensure_ascii=False)
+    print(result)
+
+
+def subscribe(address):
+    '''Statuses of running instance, till it is stopped'''
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        s.connect(address)
+    except socket.error:
+        return
+
+    with s:
+        s.sendall(b'subscribe\n')
+        for line in s.makefile('rb'):
+            reply = json.loads(line.decode())
+            if reply['ok']:
+                yield reply['result']
+
+
+def watch(address, format='i3bar'):
+    '''Print status on every change, reconnect if instance is restarted
+
+    Empty status is printed once per disconnect, then reconnects are
+    delayed more and more (up to 30 seconds) till instance is started.
+    '''
+    if format == 'i3bar':
+        print(json.dumps({'version': 1}))
+        print('[', flush=True)
+
+    delay, cleared = 1, False
+    while True:
+        for status in subscribe(address):
+            delay, cleared = 1, False
+            if format == 'i3bar':
+                line = json.dumps([{
+                    'name': 'tider',
+                    'full_text': status['text'],
+                    'markup': 'pango',
+                }], ensure_ascii=False) + ','
+            else:
+                line = json.dumps(status, ensure_ascii=False)
+            print(line, flush=True)
+
+        if format == 'i3bar' and not cleared:
+            print('[],', flush=True)
+        cleared = True
+        time.sleep(delay)
+        delay = min(delay * 2, 30)
 
 
 def get_actions():
@@ -701,6 +2495,8 @@ def get_actions():
 
 
 def parse_interval(interval):
+    import datetime as dt
+
     def get_named(name):
         named = re.match(r'^(\d*)(w|week|m|month|y|year)$', name.lower())
         if not named:
@@ -750,8 +2546,16 @@ def parse_interval(interval):
     return result
 
 
-def process_args(args):
-    conf = get_config()
+def open_db_shell(conf, cmd):
+    import subprocess as sp
+
+    sp.call('%s %s' % (cmd, conf.db_path), shell=True)
+
+
+def process_args(conf, args):
+    # argparse is imported here, because "call" doesn't need it
+    import argparse
+
     parser = argparse.ArgumentParser(prog='tider')
     cmds = parser.add_subparsers(title='commands')
 
@@ -764,7 +2568,8 @@ def process_args(args):
 
     cmd('call', help='call a specific action')\
         .arg('name', choices=get_actions(), help='choice action')\
-        .exe(lambda a: print(send_action(conf.socket, a.name)))
+        .arg('arg', nargs='?', help='action argument')\
+        .exe(lambda a: print_result(send_action(conf.socket, a.name, a.arg)))
 
     cmd('report', aliases=['re'], help='print report')\
         .arg('-i', '--interval', help=(
@@ -775,11 +2580,39 @@ def process_args(args):
         .arg('-w', '--weekly', action='store_true', help='weekly report')\
         .arg('-m', '--monthly', action='store_true', help='monthly report')\
         .arg('-t', '--target', help='filter targets (sqlite like syntax)')\
-        .arg('-q', '--quiet', action='store_true', help='less output')
+        .arg('--tree', action='store_true', help=(
+            'roll up targets by parts split before target_separators'
+        ))\
+        .arg('-q', '--quiet', action='store_true', help='less output')\
+        .arg('-f', '--format', choices=REPORT_FORMATS, default='text')
+
+    cmd('daemon', help='run without GUI')\
+        .arg('-o', '--output', default='-', help=(
+            'file for text_hook result, "-" is stdout'
+        ))\
+        .exe(lambda a: Daemon(conf, a.output))
+
+    cmd('watch', help='print status on every change')\
+        .arg('-f', '--format', choices=('i3bar', 'json'), default='i3bar')\
+        .exe(lambda a: watch(conf.socket, a.format))
 
     cmd('db', help='enter to sqlite session')\
         .arg('--cmd', default=conf.sqlite_manager, help='sqlite manager')\
-        .exe(lambda a: sp.call('%s %s' % (a.cmd, conf.db_path), shell=True))
+        .exe(lambda a: open_db_shell(conf, a.cmd))
+
+    cmd('export', help='export log')\
+        .arg('-f', '--format', choices=LOG_FORMATS, default='csv')\
+        .arg('path', nargs='?', default='-', help='file, "-" is stdout')\
+        .exe(lambda a: export_log(conf, a.path, a.format))
+
+    cmd('import', help='import log, existing rows are skipped')\
+        .arg('-f', '--format', choices=LOG_FORMATS, default='csv')\
+        .arg('path', nargs='?', default='-', help='file, "-" is stdin')\
+        .exe(lambda a: import_log(conf, a.path, a.format))
+
+    cmd('merge', help='merge logs of other machines')\
+        .arg('dbs', nargs='+', metavar='db', help='path to other log.db')\
+        .exe(lambda a: merge_log(conf, a.dbs))
 
     cmd('conf', help='print default config')\
         .exe(lambda a: print(DEFAULT_CONFIG))
@@ -792,48 +2625,20 @@ def process_args(args):
         args.exe(args)
 
     elif args.cmd == 'report':
-        interval = result = []
-        report = lambda interval, **kw: (get_report(
-            conf, interval, args.target, quiet=args.quiet
-        ))
+        interval = []
         if args.interval:
             interval_ = parse_interval(args.interval)
             interval = [time.strftime(SQL_DATE, i) for i in interval_]
-        if len(interval) == 2 and (args.daily or args.weekly or args.monthly):
-            strftime = lambda t, f=SQL_DATE: (
-                time.strftime(f, time.localtime(t))
-            )
-            # Is first day in month or week
-            is_firstday = lambda t: (
-                int(time.strftime('%d', time.localtime(t))) == 1
-                if args.monthly else
-                int(time.strftime('%w', time.localtime(t))) == 1
-            )
 
-            day = 60 * 60 * 24
-            begin, end = [time.mktime(i) for i in interval_]
-            begin_ = begin
-            for i in range(math.ceil((end - begin) / day) + 1):
-                cur = begin + i * day
-                if args.daily:
-                    result += [report([strftime(cur)])]
-                else:
-                    next_ = begin + day * (i + 1)
-                    if is_firstday(next_) or cur >= end:
-                        label = None
-                        if args.monthly:
-                            label = (
-                                strftime(cur, 'for %B %Y')
-                                if is_firstday(begin_) and is_firstday(next_)
-                                else None
-                            )
-                        int_ = [strftime(begin_), strftime(cur)]
-                        result += [report(int_, label=label)]
-                        begin_ = next_
-
-        result += [report(interval)]
-        result = '\n\n'.join(r for r in result if r)
-        result = re.sub(r'<[^>]+>', '', result)
+        granularity = (
+            'daily' if args.daily else
+            'weekly' if args.weekly else
+            'monthly' if args.monthly else
+            None
+        )
+        tree = conf.target_separators if args.tree else None
+        reports = get_reports(conf, interval, granularity, args.target, tree)
+        result = REPORT_FORMATS[args.format](reports, args.quiet)
         print(result)
 
     else:
@@ -844,8 +2649,31 @@ def tider(args=None):
     if args is None:
         args = sys.argv[1:]
 
-    process_args(args)
+    try:
+        conf = get_config()
+    except ValueError as e:
+        raise SystemExit(e)
+
+    # Hotkeys run "call" often, so it doesn't wait for building the parser,
+    # anything unusual (options, wrong action) is left to the parser
+    call = args[:1] == ['call'] and 1 < len(args) < 4
+    if call and args[1] in get_actions() and args[-1][:1] != '-':
+        print_result(send_action(conf.socket, *args[1:]))
+        return
+    process_args(conf, args)
+
+
+def main():
+    '''Run in the current process, start it again after restart action'''
+    try:
+        tider()
+    except SystemExit as e:
+        if e.code != RESTART:
+            raise
+
+        sys.stdout.flush()
+        os.execv(sys.executable, [sys.executable] + sys.argv)
 
 
 if __name__ == '__main__':
-    tider()
+    main()